@@ -0,0 +1,201 @@
+"""Benchmark all endpoints of the server.
+
+Usage:
+    python run.py [--session ID] [--requests N] [--concurrency N] [--output FILE] [--baseline FILE]
+
+Requests are sent through Flask's test client, so no separate server process is needed. A MongoDB with a
+(synthetic) session is required, see ``synthetic.py``.
+
+Each scenario is run twice:
+    - sequentially, to measure latency, response size and database round trips per request
+    - from `concurrency` threads at once, to measure throughput under load
+
+Results are printed and can be written to a JSON file. If a baseline file (output of a previous run)
+is given, the relative change of p50/p99 latency and throughput is reported for each scenario.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import monitoring
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts all commands which are sent to MongoDB (database round trips)"""
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# needs to be registered before the server creates its database client
+counter = CommandCounter()
+monitoring.register(counter)
+
+import app  # noqa: E402
+import lookuptables  # noqa: E402
+
+server = None  # created in main()
+
+
+def scenarios(session_id, event_id, drivers):
+    """Return a list of (name, method, url, payload, headers) for all endpoints"""
+    telemetry = {'session': session_id, 'drivers': drivers, 'channel': 'Speed'}
+    json_accept = {'Accept': 'application/json'}
+    return [
+        ('info/events', 'GET', '/info/events', None, {}),
+        ('info/sessions', 'GET', '/info/sessions/{}'.format(event_id), None, {}),
+        ('info/drivers', 'GET', '/info/drivers', None, {}),
+        ('info/channels', 'GET', '/info/channels', None, {}),
+        ('telemetry/fastest', 'POST', '/data/telemetry', dict(telemetry, selectBy='fastest'), json_accept),
+        ('telemetry/laps', 'POST', '/data/telemetry', dict(telemetry, selectBy='laps', laps=[1, 2, 3, 4, 5]),
+         json_accept),
+        # 14:05 to 14:25 UTC on the day of the synthetic session
+        ('telemetry/time', 'POST', '/data/telemetry',
+         dict(telemetry, selectBy='time', timeStartValue=4077266700000, timeEndValue=4077267900000,
+              timeStartIn=True, timeEndIn=True),
+         json_accept),
+        # 14:10 to 14:12 UTC, clipped to the window
+        ('window', 'POST', '/data/window',
+         dict(telemetry, timeStartValue=4077267000000, timeEndValue=4077267120000), json_accept),
+        ('align', 'POST', '/data/align',
+         {'session': session_id, 'laps': [{'driver': driver, 'lap': 'fastest'} for driver in drivers],
+          'channels': ['Speed', 'Throttle', 'nGear'], 'points': 500, 'axis': 'distance'}, json_accept),
+        ('telemetry/laps (4 channels)', 'POST', '/data/telemetry',
+         dict(telemetry, selectBy='laps', laps=[1, 2, 3, 4, 5], channel=['Speed', 'Throttle', 'Brake', 'nGear']),
+         json_accept),
+        ('telemetry/laps (ndjson)', 'POST', '/data/telemetry', dict(telemetry, selectBy='laps', laps=[1, 2, 3, 4, 5]),
+         {'Accept': 'application/x-ndjson'}),
+        ('telemetry/laps (binary)', 'POST', '/data/telemetry', dict(telemetry, selectBy='laps', laps=[1, 2, 3, 4, 5]),
+         {'Accept': 'application/vnd.f1analysis.columnar'}),
+    ]
+
+
+def send(client, method, url, payload, headers):
+    """Send one request; return (latency in seconds, response bytes, status code)"""
+    start = time.perf_counter()
+    if method == 'GET':
+        response = client.get(url, headers=headers)
+    else:
+        response = client.post(url, json=payload, headers=headers)
+    body = response.get_data()  # consumes streamed responses
+    return time.perf_counter() - start, len(body), response.status_code
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    k = min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)
+    return values[k]
+
+
+def run_scenario(scenario, n_requests, concurrency):
+    name, method, url, payload, headers = scenario
+    client = server.test_client()
+
+    # sequential: latency, size, round trips
+    latencies = list()
+    sizes = list()
+    round_trips = list()
+    for _ in range(n_requests):
+        before = counter.count
+        latency, size, status = send(client, method, url, payload, headers)
+        if status != 200:
+            raise RuntimeError("{} returned status {}".format(name, status))
+        round_trips.append(counter.count - before)
+        latencies.append(latency)
+        sizes.append(size)
+
+    # concurrent: throughput
+    def worker(_):
+        return send(server.test_client(), method, url, payload, headers)[0]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        concurrent_latencies = list(executor.map(worker, range(n_requests)))
+    duration = time.perf_counter() - start
+
+    return {'name': name,
+            'requests': n_requests,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'bytes': sum(sizes) / len(sizes),
+            'round_trips': sum(round_trips) / len(round_trips),
+            'concurrency': concurrency,
+            'concurrent_p50_ms': percentile(concurrent_latencies, 50) * 1000,
+            'concurrent_p99_ms': percentile(concurrent_latencies, 99) * 1000,
+            'throughput_rps': n_requests / duration}
+
+
+def compare(results, baseline):
+    """Print the relative change of each scenario compared to a baseline"""
+    baseline = {result['name']: result for result in baseline['results']}
+    print("\nCompared to baseline:")
+    for result in results:
+        base = baseline.get(result['name'])
+        if base is None:
+            continue
+        changes = ["{} {:+.0%}".format(key, result[key] / base[key] - 1)
+                   for key in ('p50_ms', 'p99_ms', 'bytes', 'throughput_rps') if base[key]]
+        print("  {:<26} {}".format(result['name'], ', '.join(changes)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the server's endpoints")
+    parser.add_argument('--session', default='2099-1-5', help="session id (default: 2099-1-5)")
+    parser.add_argument('--drivers', type=int, default=5, help="number of drivers per telemetry request")
+    parser.add_argument('--requests', type=int, default=50, help="requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--no-cache', action='store_true', help="disable the server's query cache")
+    parser.add_argument('--warm-up', type=int, default=0, metavar='N',
+                        help="preload the N most recent sessions before running the scenarios")
+    parser.add_argument('--output', help="write results to this JSON file")
+    parser.add_argument('--baseline', help="compare with the results of a previous run")
+    args = parser.parse_args()
+
+    global server
+    config = {'WARM_UP_SESSIONS': args.warm_up}
+    if args.no_cache:
+        config['CACHE_SIZE'] = 0
+    server = app.create_app(config)
+    app.init_worker(server)
+
+    event_id = '-'.join(args.session.split('-')[:2])
+    drivers = [abb for _, abb, _ in lookuptables.drivers[:args.drivers]]
+
+    results = list()
+    for scenario in scenarios(args.session, event_id, drivers):
+        result = run_scenario(scenario, args.requests, args.concurrency)
+        results.append(result)
+        print("{name:<26} p50 {p50_ms:8.2f} ms  p99 {p99_ms:8.2f} ms  {bytes:10.0f} B  "
+              "{round_trips:5.1f} queries  {throughput_rps:8.1f} req/s".format(**result))
+
+    output = {'timestamp': time.time(), 'session': args.session, 'drivers': args.drivers, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
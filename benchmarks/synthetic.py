@@ -0,0 +1,138 @@
+"""Write a synthetic session into a local MongoDB for benchmarking.
+
+Usage:
+    python synthetic.py [--drivers N] [--laps N] [--rate HZ] [--layout rows|columnar] [--session ID]
+
+The session is registered in 'F1Info.Events' and 'F1Info.Sessions' like a real session.
+Drivers are taken from the server's default roster. Lap times, lap start dates and telemetry channels
+(RPM, Speed, nGear, Throttle, Brake, DRS) follow a simple but realistic pattern, so that payload sizes and
+compression ratios are comparable to real data.
+"""
+
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pymongo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import lookuptables  # noqa: E402
+
+
+SESSION_START = datetime(2099, 3, 15, 14, 0, 0)
+
+
+def make_lap_telemetry(lap_time, session_time, rate, rng):
+    """Return a dict of channel arrays for one lap"""
+    n = int(lap_time * rate)
+    t = np.linspace(0, 1, n, endpoint=False)
+
+    # a track with eight corners; speed drops in each corner
+    profile = 0.5 + 0.5 * np.cos(t * 16 * np.pi)
+    speed = 90 + 240 * profile ** 0.5 + rng.normal(0, 2, n)
+    throttle = np.clip(profile * 140, 0, 100).round()
+    brake = (np.diff(speed, prepend=speed[0]) < -1.5).astype(int) * 100
+    gear = np.clip((speed / 42).astype(int) + 1, 1, 8)
+    rpm = 7000 + (speed % 42) / 42 * 5000
+    drs = np.where((t > 0.05) & (t < 0.15), 12, 0)
+
+    return {'SessionTime': (session_time + t * lap_time).round(3).tolist(),
+            'Time': (t * lap_time).round(3).tolist(),
+            'RPM': rpm.round().tolist(),
+            'Speed': speed.round().tolist(),
+            'nGear': gear.tolist(),
+            'Throttle': throttle.tolist(),
+            'Brake': brake.tolist(),
+            'DRS': drs.tolist()}
+
+
+def generate(client, session_id, n_drivers, n_laps, rate, layout, seed=0, summary=True):
+    """Write timing data and telemetry data of a synthetic session; existing data of the session is replaced.
+
+    If `summary` is True, a lap summary is written as well (like populate_db_from_fastf1.build_lap_summary).
+
+    :return: dict with the number of laps and samples which were written
+    """
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+
+    client.drop_database(session_id)
+    database = client[session_id]
+
+    event_id = '-'.join(session_id.split('-')[:2])
+    client['F1Info']['Events'].replace_one({'id': event_id}, {'id': event_id, 'name': 'Synthetic GP', 'type': 'R'},
+                                           upsert=True)
+    client['F1Info']['Sessions'].update_one({'id': session_id},
+                                            {'$set': {'id': session_id, 'eventid': event_id, 'name': 'Race',
+                                                      'date': SESSION_START},
+                                             '$inc': {'revision': 1}},
+                                            upsert=True)
+
+    timing = list()
+    lap_id = 0
+    samples = 0
+    for number, abb, team in lookuptables.drivers[:n_drivers]:
+        base = 88 + random.random() * 2
+        session_time = 300.0
+        for lap_number in range(1, n_laps + 1):
+            lap_time = round(base + rng.normal(0, 0.4), 3)
+            start = SESSION_START + timedelta(seconds=session_time)
+            timing.append({'_id': lap_id, 'DriverNumber': number, 'Driver': abb, 'Team': team,
+                           'LapNumber': lap_number, 'LapTime': lap_time, 'Time': session_time + lap_time,
+                           'LapStartDate': start, 'LapEndDate': start + timedelta(seconds=lap_time)})
+
+            telemetry = make_lap_telemetry(lap_time, session_time, rate, rng)
+            samples += len(telemetry['SessionTime'])
+            if layout == 'columnar':
+                telemetry['_id'] = lap_id
+                database['lap_telemetry'].insert_one(telemetry)
+            else:
+                names = list(telemetry.keys())
+                docs = [dict(zip(names, values), LapId=lap_id) for values in zip(*telemetry.values())]
+                database['telemetry'].insert_many(docs, ordered=False)
+
+            session_time += lap_time
+            lap_id += 1
+
+    database['timingdata'].insert_many(timing, ordered=False)
+
+    if summary:
+        drivers = dict()
+        for lap in timing:
+            drivers.setdefault(lap['DriverNumber'], list()).append(
+                {key: lap[key] for key in ('_id', 'LapNumber', 'LapTime', 'LapStartDate', 'LapEndDate')})
+        database['lapsummary'].insert_one(
+            {'_id': 'summary',
+             'drivers': [{'DriverNumber': number,
+                          'FastestLapId': min(laps, key=lambda lap: lap['LapTime'])['_id'],
+                          'LapCount': len(laps),
+                          'Laps': laps} for number, laps in drivers.items()]})
+
+    return {'laps': len(timing), 'samples': samples}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic session into MongoDB")
+    parser.add_argument('--address', default='mongodb://localhost:27017')
+    parser.add_argument('--session', default='2099-1-5', help="session id (default: 2099-1-5)")
+    parser.add_argument('--drivers', type=int, default=20)
+    parser.add_argument('--laps', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=8.0, help="telemetry sample rate in Hz")
+    parser.add_argument('--layout', choices=('rows', 'columnar'), default='columnar')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-summary', action='store_true', help="do not write a lap summary")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.address)
+    result = generate(client, args.session, args.drivers, args.laps, args.rate, args.layout, args.seed,
+                      not args.no_summary)
+    print("{session}: {laps} laps, {samples} samples ({layout})".format(session=args.session, layout=args.layout,
+                                                                         **result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""Export finished sessions from MongoDB to a file archive which the server reads instead of the database.
+
+Usage:
+    python archive_sessions.py --dir DIR [session id, ...]
+
+If no session ids are given, all sessions in 'F1Info.Sessions' are exported.
+The server uses an archive as long as the session is not loaded into the database again (see module archive).
+Start the server with the same directory as ARCHIVE_DIR.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dataprovider import DataProvider  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export sessions to a file archive")
+    parser.add_argument('sessions', nargs='*', help="session ids (default: all sessions)")
+    parser.add_argument('--address', default='mongodb://localhost:27017', help="MongoDB server address")
+    parser.add_argument('--dir', required=True, help="archive directory")
+    args = parser.parse_args()
+
+    dp = DataProvider(args.address, cache_size=0, archive_dir=args.dir)
+    sessions = args.sessions or [session['id'] for session in dp.get_sessions_names()]
+
+    for session_id in sessions:
+        start_time = time.time()
+        directory = dp.export_archive(session_id)
+        print("{}: {} ({:.1f}s)".format(session_id, directory, time.time() - start_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Create the indexes which are required by the server and verify that its queries use them.
+
+Usage:
+    python manage_indexes.py [--create] [--explain] [session id, ...]
+
+If no session ids are given, all sessions in 'F1Info.Sessions' are processed.
+Exits with status 1 if any query uses a collection scan.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dataprovider import DataProvider  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create and verify indexes for session databases")
+    parser.add_argument('sessions', nargs='*', help="session ids (default: all sessions)")
+    parser.add_argument('--address', default='mongodb://localhost:27017', help="MongoDB server address")
+    parser.add_argument('--create', action='store_true', help="create missing indexes")
+    parser.add_argument('--explain', action='store_true', help="report queries which use collection scans")
+    args = parser.parse_args()
+
+    dp = DataProvider(args.address, cache_size=0)
+    sessions = args.sessions or [session['id'] for session in dp.get_sessions_names()]
+
+    collscans = 0
+    for session_id in sessions:
+        print(session_id)
+
+        if args.create:
+            for name in dp.ensure_indexes(session_id):
+                print("\tindex {}".format(name))
+
+        if args.explain:
+            for result in dp.explain_queries(session_id):
+                print("\t{}: {}".format('COLLSCAN' if result['collscan'] else 'ok', result['query']))
+                collscans += result['collscan']
+
+    if collscans:
+        print("{} queries use collection scans".format(collscans))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,47 @@
-import sys
+"""Load timing data and telemetry data from FastF1 into the database.
+
+Usage:
+    python populate_db_from_fastf1.py [options] [YEAR:GP:EVENT:SESSION_ID ...]
+
+Multiple sessions can be loaded at once, they are processed in parallel by a pool of worker processes.
+If no session is given, the session which is configured below is loaded.
+
+Options:
+    --workers N     number of worker processes (default: number of sessions, at most the number of CPUs)
+    --layout L      telemetry storage layout, 'rows' or 'columnar' (default: TELEMETRY_LAYOUT)
+    --no-info       do not load timing data
+    --no-telemetry  do not load telemetry data
+    --full          drop and reload the timing and telemetry data instead of updating only changed laps
+    --convert       convert existing sessions (by SESSION_ID) from the row layout to the columnar layout
+"""
+
+import argparse
+import hashlib
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import pymongo
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
 import pandas as pd
 import numpy as np
 
 import fastf1
 fastf1.utils.enable_cache('D:\\Dateien\\FF1Data')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dataprovider import DataProvider  # noqa: E402
+
+DB_ADDRESS = 'mongodb://localhost:27017'
+
 # Delete current elements which are not updated? Be careful with this setting!
 DELETE_NOT_UPDATED = True
 
+# Only write laps whose timing data or telemetry data changed (see load_session_incremental)
+INCREMENTAL = True
+
 # Event selection
 # YEAR = 2020
 # GP = 'testing'
@@ -19,6 +50,17 @@ YEAR = 2019
 GP = 10
 EVENT = 'R'
 
+# Telemetry storage layout
+# 'rows': one document per sample in collection 'telemetry'
+# 'columnar': one document per lap (one array per channel) in collection 'lap_telemetry'
+TELEMETRY_LAYOUT = 'columnar'
+
+# Drop the 'telemetry' collection after converting a session to the columnar layout?
+DROP_ROW_TELEMETRY = False
+
+# Maximum number of documents per bulk write (row layout: samples; columnar layout: laps / 10)
+BATCH_SIZE = 50000
+
 # Database names
 # SESSION_ID = '2020-101-3'
 SESSION_ID = '2019-10-5'
@@ -48,95 +90,426 @@ info_labels = ['Time',
 timedelta_conv = ['Time', 'LapTime', 'PitInTime', 'PitOutTime', 'Sector1Time', 'Sector2Time', 'Sector3Time']
 
 
-mongo_client = pymongo.MongoClient('mongodb://localhost:27017')
-database = mongo_client[SESSION_ID]
+class IngestStats:
+    def __init__(self, session_id):
+        """Counts processed rows and written documents for reporting throughput."""
+        self.session_id = session_id
+        self.rows = 0  # laps and telemetry samples
+        self.docs = 0  # documents written to the database
+        self.duration = 0.0
 
-session = fastf1.core.get_session(YEAR, GP, EVENT)
-session.load_laps()
+    def report(self):
+        rate = 1 / self.duration if self.duration else 0
+        return "{}: {} rows, {} docs in {:.1f}s ({:.0f} rows/s, {:.0f} docs/s)".format(
+            self.session_id, self.rows, self.docs, self.duration, self.rows * rate, self.docs * rate)
 
 
-def load_info_data():
-    """Load info data like Lap Times, Sector Times, Top Speeds, LapStartTime, Tires, ... from FastF1
-
-    Data can be added to the database, existing entries will be updated.
-    Optionally, not updated entries will be deleted.
-
-    Existing laps will not technically be updated. Instead they will be deleted and inserted newly.
-    This only needs two db calls and less filtering (i.e. easier for me)
-
-    Updating is dumb, meaning it does not check for actually changed data.
-    If an id exists in current and new data, it will be updated.
+def prepare_info_data(laps):
+    """Convert timing data for storing it in the database.
 
     If LapStartDate, LapEndDate or LapTime are not available, those values are set to 'inf' (string).
     Reason: - None, 0, NaN and similar are not possible because they are returned by mongodb $min queries
             - Infinity (e.g. numpy.inf) is supported by mongodb but not by JSON; therefore it would need to be converted by the server
               I don't want to add a check for that in the server between db query and sending response for performance reasons
-    """
-    collection = database['timingdata']
 
-    # get all existing ids in collection
-    current_ids = [res['_id'] for res in collection.find({}, {'_id': 1})]
+    All conversions are vectorized.
 
-    # ####### Prepare Data ########
+    :param laps: FastF1 laps
+    :return: list of dicts, one per lap; the lap's id is stored as '_id'
+    """
     # filter out telemetry
-    data = session.laps.filter(info_labels)
+    data = laps.filter(info_labels)
 
     # create a new column 'LapEndDate'. This is done to allow more efficient database querying
-    def lap_end_date_sum(d):
-        r = d['LapStartDate'] + d['LapTime']
-        return pd.to_datetime(r) if not pd.isnull(r) else 'inf'  # convert to datetime right away; this needs to be done anyway
-
-    lap_end_date = pd.DataFrame({'LapEndDate': data.filter(['LapTime', 'LapStartDate']).aggregate(lap_end_date_sum, axis="columns")})
-    data = data.join(lap_end_date)
+    lap_end_date = data['LapStartDate'] + data['LapTime']
+    data['LapEndDate'] = lap_end_date.astype(object).where(lap_end_date.notna(), 'inf')
 
     # convert LapStartTime to python builtin datetime
-    data['LapStartDate'] = data['LapStartDate'].apply(lambda itm: 'inf' if pd.isnull(itm) else pd.to_datetime(itm))
+    data['LapStartDate'] = data['LapStartDate'].astype(object).where(data['LapStartDate'].notna(), 'inf')
 
     # mongodb does not support pd.Timedelta; convert to seconds (floating point)
     for key in timedelta_conv:
-        data[key] = data[key].apply(lambda itm: itm.total_seconds())
+        data[key] = data[key].dt.total_seconds()
 
     # if LapTime is NaN replace with 'inf'; mongodb will return NaN as minimum value but I need to be able to search with min
-    data['LapTime'] = data['LapTime'].apply(lambda itm: 'inf' if pd.isnull(itm) else itm)
+    data['LapTime'] = data['LapTime'].astype(object).where(data['LapTime'].notna(), 'inf')
+
+    return data.reset_index().rename(columns={'index': '_id'}).to_dict(orient='records')
+
+
+def prepare_telemetry(laps):
+    """Concatenate the telemetry data of all laps and convert it for storing it in the database.
+
+    :param laps: FastF1 laps
+    :return: one DataFrame with the samples of all laps; column 'LapId' holds each sample's lap id
+    """
+    lap_ids = list()
+    frames = list()
+    for num, data in laps.telemetry.iteritems():
+        if isinstance(data, pd.DataFrame) and not data.empty:
+            lap_ids.append(num)
+            frames.append(data)
+    if not frames:
+        return pd.DataFrame()
+
+    data = pd.concat(frames, keys=lap_ids, names=['LapId', 'index']).reset_index()
 
-    data = data.reset_index().rename(columns={'index': '_id'}).to_dict(orient='records')
+    data['Time'] = data['Time'].dt.total_seconds()
+    data['SessionTime'] = data['SessionTime'].dt.total_seconds()
+
+    return data
+
+
+def load_info_data(database, laps, stats):
+    """Load info data like Lap Times, Sector Times, Top Speeds, LapStartTime, Tires, ... from FastF1
+
+    The collection is replaced.
+    """
+    collection = database['timingdata']
+
+    data = prepare_info_data(laps)
 
     # modify DB
     collection.drop()
-    collection.insert_many(data)
+    if data:
+        collection.insert_many(data, ordered=False)
+    stats.rows += len(data)
+    stats.docs += len(data)
+
+
+def load_telemetry(database, laps, stats, layout=TELEMETRY_LAYOUT):
+    """Load telemetry data from FastF1 using the given storage layout ('rows' or 'columnar')
+
+    The session's telemetry data is replaced. 'lap_telemetry' is always dropped, the server would otherwise keep
+    reading it. 'telemetry' is only dropped when loading the row layout (see also DROP_ROW_TELEMETRY).
+    """
+    database['lap_telemetry'].drop()
+    if layout != 'columnar':
+        database['telemetry'].drop()
+
+    data = prepare_telemetry(laps)
+    stats.rows += len(data)
+    if data.empty:
+        return
+
+    if layout == 'columnar':
+        load_telemetry_columnar(database, data, stats)
+    else:
+        load_telemetry_rows(database, data, stats)
+
+
+def load_telemetry_rows(database, data, stats):
+    """Store one document per telemetry sample. Samples are appended to the existing data."""
+    collection = database['telemetry']
+
+    for start in range(0, len(data), BATCH_SIZE):
+        docs = data.iloc[start:start + BATCH_SIZE].to_dict(orient='records')
+        collection.insert_many(docs, ordered=False)
+        stats.docs += len(docs)
+
+
+def load_telemetry_columnar(database, data, stats):
+    """Store one document per lap, containing one array per channel.
+
+    Existing laps are replaced.
+    """
+    collection = database['lap_telemetry']
+    channels = [name for name in data.columns if name not in ('LapId', 'index')]
+
+    docs = list()
+    for lap_id, lap in data.groupby('LapId', sort=False):
+        docs.append(_lap_doc(_to_builtin(lap_id), lap, channels))
+
+        if len(docs) >= BATCH_SIZE // 10:
+            _replace_laps(collection, docs)
+            stats.docs += len(docs)
+            docs = list()
+
+    if docs:
+        _replace_laps(collection, docs)
+        stats.docs += len(docs)
+
 
-    # DB preparation
-    collection.create_index('LapTime')
+def _lap_doc(lap_id, lap, channels):
+    doc = {'_id': lap_id}
+    for channel in channels:
+        doc[channel] = lap[channel].tolist()
+    return doc
 
 
-def load_telemetry():
+def _to_builtin(value):
+    return value.item() if isinstance(value, np.generic) else value
 
+
+def current_telemetry_layout(database):
+    """Return the layout of the session's stored telemetry data ('rows' or 'columnar'), None if there is none.
+
+    Same rule as the server (:meth:`DataProvider.get_telemetry_layout`): a session with a collection
+    'lap_telemetry' uses the columnar layout.
+    """
+    names = database.list_collection_names()
+    if 'lap_telemetry' in names:
+        return 'columnar'
+    return 'rows' if 'telemetry' in names else None
+
+
+def _timing_hash(doc):
+    """Content hash of a lap's timing data (dict)"""
+    return hashlib.sha1(repr(sorted(doc.items())).encode('utf-8')).hexdigest()
+
+
+def _telemetry_hash(lap):
+    """Content hash of a lap's telemetry data (DataFrame); vectorized"""
+    values = pd.util.hash_pandas_object(lap.drop(columns=['LapId', 'index'], errors='ignore'), index=False)
+    return hashlib.sha1(values.values.tobytes()).hexdigest()
+
+
+def load_session_incremental(database, laps, stats, layout=TELEMETRY_LAYOUT, info=True, telemetry=True):
+    """Update a session in place; only laps whose data has changed are written.
+
+    A content hash of each lap's timing data ('TimingHash') and telemetry data ('TelemetryHash') is stored
+    in 'timingdata'. Laps with unchanged hashes are skipped. Laps which no longer exist are deleted if
+    DELETE_NOT_UPDATED is set.
+
+    No collection is dropped, so the session stays available while it is updated. Changed telemetry is written
+    before the timing data which references it. Vanished laps are removed from the timing data first.
+
+    The hashes only describe the content, not the layout. If the session's telemetry is stored in a different
+    layout than `layout`, the telemetry of all laps is written again. When switching to the row layout,
+    'lap_telemetry' is dropped afterwards; when switching to the columnar layout, 'telemetry' is kept like
+    after --convert.
+
+    :return: True if anything was changed
+    """
+    timing_collection = database['timingdata']
+    current = {doc['_id']: doc for doc in timing_collection.find({}, {'TimingHash': 1, 'TelemetryHash': 1})}
+    updates = dict()  # lap id -> fields which are set in 'timingdata'
+    deleted = list()  # ids of laps which are removed completely
+    stale_telemetry = list()  # ids of laps whose telemetry is removed
+    rewrite = False  # telemetry of all laps is written because the layout changes
+
+    if telemetry:
+        data = prepare_telemetry(laps)
+        stats.rows += len(data)
+
+        # the stored hashes only describe the telemetry of the current layout
+        current_layout = current_telemetry_layout(database)
+        rewrite = current_layout is not None and current_layout != layout
+
+        changed = list()  # tuples (lap id, telemetry, hash)
+        if not data.empty:
+            for lap_id, lap in data.groupby('LapId', sort=False):
+                lap_id = _to_builtin(lap_id)
+                telemetry_hash = _telemetry_hash(lap)
+                if rewrite or current.get(lap_id, {}).get('TelemetryHash') != telemetry_hash:
+                    changed.append((lap_id, lap, telemetry_hash))
+                    updates[lap_id] = {'TelemetryHash': telemetry_hash}
+
+        if DELETE_NOT_UPDATED:
+            lap_ids = set(data['LapId'].unique()) if not data.empty else set()
+            stale_telemetry = [lap_id for lap_id, doc in current.items()
+                               if doc.get('TelemetryHash') and lap_id not in lap_ids]
+
+        _write_telemetry_changes(database, changed, layout, stats)
+        if rewrite and layout == 'rows':
+            database['lap_telemetry'].drop()
+
+    if info:
+        new_ids = set()
+        for doc in prepare_info_data(laps):
+            stats.rows += 1
+            new_ids.add(doc['_id'])
+            timing_hash = _timing_hash(doc)
+            if current.get(doc['_id'], {}).get('TimingHash') != timing_hash:
+                doc['TimingHash'] = timing_hash
+                updates.setdefault(doc['_id'], dict()).update(doc)
+
+        if DELETE_NOT_UPDATED:
+            deleted = [lap_id for lap_id in current.keys() if lap_id not in new_ids]
+
+    if updates:
+        requests = list()
+        for lap_id, fields in updates.items():
+            fields.pop('_id', None)
+            requests.append(UpdateOne({'_id': lap_id}, {'$set': fields}, upsert=info))
+        timing_collection.bulk_write(requests, ordered=False)
+        stats.docs += len(requests)
+
+    if deleted:
+        timing_collection.delete_many({'_id': {'$in': deleted}})
+        stats.docs += len(deleted)
+
+    stale_telemetry = list(set(stale_telemetry) | set(deleted))
+    if stale_telemetry:
+        if layout == 'columnar':
+            stats.docs += database['lap_telemetry'].delete_many({'_id': {'$in': stale_telemetry}}).deleted_count
+        else:
+            stats.docs += database['telemetry'].delete_many({'LapId': {'$in': stale_telemetry}}).deleted_count
+        timing_collection.update_many({'_id': {'$in': stale_telemetry}}, {'$unset': {'TelemetryHash': ''}})
+
+    return bool(updates or deleted or stale_telemetry or rewrite)
+
+
+def _write_telemetry_changes(database, changed, layout, stats):
+    """Write the telemetry of changed laps.
+
+    Columnar layout: each lap document is replaced atomically.
+    Row layout: the new samples are inserted (tagged with the lap's hash) before the old samples of
+    the same lap are deleted.
+    """
+    if not changed:
+        return
+
+    if layout == 'columnar':
+        collection = database['lap_telemetry']
+        channels = [name for name in changed[0][1].columns if name not in ('LapId', 'index')]
+        for start in range(0, len(changed), BATCH_SIZE // 10):
+            requests = [ReplaceOne({'_id': lap_id}, _lap_doc(lap_id, lap, channels), upsert=True)
+                        for lap_id, lap, _ in changed[start:start + BATCH_SIZE // 10]]
+            collection.bulk_write(requests, ordered=False)
+            stats.docs += len(requests)
+
+    else:
+        collection = database['telemetry']
+        data = pd.concat([lap.assign(LapHash=telemetry_hash) for _, lap, telemetry_hash in changed])
+        for start in range(0, len(data), BATCH_SIZE):
+            docs = data.iloc[start:start + BATCH_SIZE].to_dict(orient='records')
+            collection.insert_many(docs, ordered=False)
+            stats.docs += len(docs)
+
+        requests = [DeleteMany({'LapId': lap_id, 'LapHash': {'$ne': telemetry_hash}})
+                    for lap_id, _, telemetry_hash in changed]
+        stats.docs += collection.bulk_write(requests, ordered=False).deleted_count
+
+
+def _replace_laps(collection, docs):
+    collection.delete_many({'_id': {'$in': [doc['_id'] for doc in docs]}})
+    collection.insert_many(docs, ordered=False)
+
+
+def convert_telemetry_to_columnar(database):
+    """Convert the telemetry data of an existing session from the row layout to the columnar layout.
+
+    The conversion is done by the database server. Samples are sorted by 'SessionTime' and grouped by 'LapId'.
+    The collection 'lap_telemetry' is replaced.
+
+    The 'TelemetryHash' of each lap stays valid because the content is unchanged; the next incremental load
+    (see :func:`load_session_incremental`) continues with the columnar layout.
+    """
     collection = database['telemetry']
 
-    # get all existing ids in collection
-    # current_ids = [res['_id'] for res in collection.find({}, {'_id': 1})]
+    sample = collection.find_one({}, {'_id': 0, 'LapId': 0, 'index': 0, 'LapHash': 0})
+    if sample is None:
+        print("No telemetry data found for {}".format(database.name))
+        return
+
+    # $ifNull keeps all channel arrays equally long if a sample is missing a value
+    group = {'_id': '$LapId'}
+    for channel in sample.keys():
+        group[channel] = {'$push': {'$ifNull': ['$' + channel, None]}}
+
+    pipeline = [{'$sort': {'LapId': 1, 'SessionTime': 1}},
+                {'$group': group},
+                {'$out': 'lap_telemetry'}]
+    collection.aggregate(pipeline, allowDiskUse=True)
 
-    for num, data in session.laps.telemetry.iteritems():
-        # telemetry data for one lap
-        print(num)
-        if isinstance(data, pd.DataFrame):
-            # check for ids which already exist in the db
-            # update_ids = [_id for _id in data.index if _id in current_ids]
+    print("Converted {} samples to {} laps".format(collection.estimated_document_count(),
+                                                  database['lap_telemetry'].estimated_document_count()))
 
-            data['Time'] = data['Time'].apply(lambda itm: itm.total_seconds())
-            data['SessionTime'] = data['SessionTime'].apply(lambda itm: itm.total_seconds())
+    if DROP_ROW_TELEMETRY:
+        print("Dropping collection 'telemetry' of {}".format(database.name))
+        if get_confirmation():
+            collection.drop()
 
-            data['LapId'] = num
 
-            # create list of dicts for passing to .insert_many(); include Series indices
-            # data = data.reset_index().rename(columns={'index': '_id'}).to_dict(orient='records')
-            data = data.reset_index().to_dict(orient='records')
+def create_indexes(database):
+    """Create the indexes which are required by the server's queries (see DataProvider.SESSION_INDEXES).
 
-            # modify DB
-            # if update_ids:
-            #     collection.delete_many({'_id': {'$in': update_ids}})  # delete data points which should be 'updated'
-            if data:
-                collection.insert_many(data)  # insert new and 'updated'
+    Collections which do not exist are skipped; see also manage_indexes.py.
+    """
+    names = database.list_collection_names()
+    for collection_name, indexes in DataProvider.SESSION_INDEXES.items():
+        if collection_name in names:
+            for keys in indexes:
+                database[collection_name].create_index(keys)
+
+
+def build_lap_summary(database):
+    """Create the lap summary of a session from its timing data (collection 'lapsummary').
+
+    The summary is a single document which holds each driver's fastest lap id, number of laps and a compact list
+    of all laps (id, number, time, start and end date). The server loads it once and resolves fastest laps and lap
+    numbers from memory. The fastest lap is determined numerically; laps without a lap time ('inf') are ignored.
+    """
+    fields = {'DriverNumber': 1, 'LapNumber': 1, 'LapTime': 1, 'LapStartDate': 1, 'LapEndDate': 1}
+    drivers = dict()
+    for lap in database['timingdata'].find({}, fields).sort('LapNumber', 1):
+        drivers.setdefault(lap.pop('DriverNumber'), list()).append(lap)
+
+    summary = list()
+    for number, laps in drivers.items():
+        timed = [lap for lap in laps if isinstance(lap['LapTime'], (int, float)) and not np.isnan(lap['LapTime'])]
+        fastest = min(timed, key=lambda lap: lap['LapTime']) if timed else None
+        summary.append({'DriverNumber': number,
+                        'FastestLapId': fastest['_id'] if fastest is not None else None,
+                        'LapCount': len(laps),
+                        'Laps': laps})
+
+    database['lapsummary'].replace_one({'_id': 'summary'}, {'_id': 'summary', 'drivers': summary}, upsert=True)
+
+
+def bump_session_revision(mongo_client, session_id):
+    """Increment the revision of the session in 'F1Info.Sessions'.
+
+    Running servers discard their cached data for this session when they notice the new revision.
+    Sessions which are not listed yet are added with only 'id' and 'revision'; servers only track the revisions
+    of listed sessions.
+    """
+    mongo_client['F1Info']['Sessions'].update_one({'id': session_id}, {'$inc': {'revision': 1}}, upsert=True)
+
+
+def ingest_session(spec, layout=TELEMETRY_LAYOUT, info=True, telemetry=True, incremental=INCREMENTAL):
+    """Load one session from FastF1 into the database.
+
+    Runs in a worker process; each worker uses its own database client.
+    The session's revision is only incremented if data has changed.
+
+    :param spec: tuple (year, gp, event, session id)
+    :return: :class:`IngestStats`
+    """
+    year, gp, event, session_id = spec
+    start_time = time.time()
+
+    mongo_client = pymongo.MongoClient(DB_ADDRESS)
+    database = mongo_client[session_id]
+    stats = IngestStats(session_id)
+
+    session = fastf1.core.get_session(year, gp, event)
+    session.load_laps()
+
+    if incremental:
+        changed = load_session_incremental(database, session.laps, stats, layout, info=info, telemetry=telemetry)
+    else:
+        if info:
+            load_info_data(database, session.laps, stats)
+        if telemetry:
+            load_telemetry(database, session.laps, stats, layout=layout)
+        changed = True
+
+    create_indexes(database)
+
+    if changed:
+        build_lap_summary(database)
+        bump_session_revision(mongo_client, session_id)
+
+    stats.duration = time.time() - start_time
+    return stats
+
+
+def parse_session_spec(spec):
+    """Parse 'YEAR:GP:EVENT:SESSION_ID'; numeric GP and EVENT values are converted to int"""
+    year, gp, event, session_id = spec.split(':')
+    return int(year), int(gp) if gp.isdigit() else gp, int(event) if event.isdigit() else event, session_id
 
 
 def get_confirmation():
@@ -150,6 +523,45 @@ def get_confirmation():
         return False
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Load sessions from FastF1 into the database",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('sessions', nargs='*', help="sessions as YEAR:GP:EVENT:SESSION_ID")
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--layout', choices=('rows', 'columnar'), default=TELEMETRY_LAYOUT)
+    parser.add_argument('--no-info', action='store_true')
+    parser.add_argument('--no-telemetry', action='store_true')
+    parser.add_argument('--convert', action='store_true')
+    parser.add_argument('--full', action='store_true')
+    args = parser.parse_args()
+
+    specs = [parse_session_spec(spec) for spec in args.sessions] or [(YEAR, GP, EVENT, SESSION_ID)]
+
+    if args.convert:
+        # migrate existing sessions from the row layout to the columnar layout
+        mongo_client = pymongo.MongoClient(DB_ADDRESS)
+        for _, _, _, session_id in specs:
+            convert_telemetry_to_columnar(mongo_client[session_id])
+            bump_session_revision(mongo_client, session_id)
+        return
+
+    workers = args.workers or min(len(specs), os.cpu_count() or 1)
+    start_time = time.time()
+    total = IngestStats('total')
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(ingest_session, spec, args.layout, not args.no_info, not args.no_telemetry,
+                                   INCREMENTAL and not args.full)
+                   for spec in specs]
+        for future in futures:
+            stats = future.result()
+            print(stats.report())
+            total.rows += stats.rows
+            total.docs += stats.docs
+
+    total.duration = time.time() - start_time
+    print(total.report())
+
+
 if __name__ == '__main__':
-    # load_info_data()
-    load_telemetry()
+    sys.exit(main())
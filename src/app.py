@@ -7,65 +7,440 @@ This is the main server module (using flask).
 It handles requests according too the API documentation.
 """
 
-from flask import Flask, jsonify, request
+import hashlib
+import os
+import tempfile
+import threading
+
+from flask import Blueprint, Flask, Response, current_app, json, jsonify, request
 from flask_cors import CORS
+from werkzeug.local import LocalProxy
 
+from cache import LRUCache, SingleFlight
+import compression
 from dataprovider import DataProvider
+import encoding
 import lookuptables
+import metrics
+
+
+# default configuration; can be overridden by a file given in the environment variable F1ANALYSIS_SETTINGS
+# and by the `config` argument of create_app
+DB_ADDRESS = 'mongodb://localhost:27017'
+DB_MAX_POOL_SIZE = 100  # maximum number of connections per worker process
+DB_MIN_POOL_SIZE = 0
+DB_CONNECT_TIMEOUT_MS = 5000
+DB_SERVER_SELECTION_TIMEOUT_MS = 10000
+DB_SOCKET_TIMEOUT_MS = None  # None: no timeout
+CACHE_SIZE = 256 * 1024 ** 2  # size limit of the query cache per worker process in bytes; 0 disables it
+REVISION_CHECK_INTERVAL = 60  # minimum time between checks for reloaded sessions in seconds
+QUERY_WORKERS = 4  # maximum number of concurrent telemetry queries per request
+ARCHIVE_DIR = None  # directory with archived sessions (see scripts/archive_sessions.py); None: database only
+WARM_UP_SESSIONS = 0  # number of most recent sessions which are preloaded by init_worker; 0 disables the warm-up
+WARM_UP_CHANNELS = list(lookuptables.channel_names.values())  # channels of the fastest laps which are preloaded
+INFO_MAX_AGE = 300  # Cache-Control max-age for /info/* responses in seconds
+TELEMETRY_MAX_AGE = 3600  # Cache-Control max-age for /data/telemetry responses in seconds
+PREPARED_CACHE_SIZE = 64 * 1024 ** 2  # size limit for pre-serialized (and compressed) response bodies in bytes
+METRICS_ENABLED = True  # Server-Timing headers and /metrics
+METRICS_DIR = None  # directory for sharing /metrics between worker processes (see init_shared_metrics)
+COMPRESSION_ENABLED = True  # gzip/brotli compression negotiated by Accept-Encoding
+COMPRESSION_MIN_SIZE = 1024  # bodies smaller than this are not compressed (in bytes)
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+bp = Blueprint('api', __name__)
+
+# static data is versioned by its content
+channels_version = hashlib.sha1(repr(lookuptables.json_channel_names).encode('utf-8')).hexdigest()
+
+
+def create_app(config=None):
+    """Create and configure the app.
+
+    No database connection is made here. Each process creates its own database client on first use
+    (see :func:`get_dataprovider`), so the app can be created before a pre-fork server (e.g. gunicorn) forks its
+    worker processes. Call :func:`init_worker` in each worker to connect and warm up before serving requests.
+
+    :param config: (optional) dict of configuration values; overrides the defaults of this module
+    :type config: dict
+    :rtype: flask.Flask
+    """
+    flask_app = Flask(__name__)
+    flask_app.config.from_object(__name__)
+    flask_app.config.from_envvar('F1ANALYSIS_SETTINGS', silent=True)
+    flask_app.config.update(config or dict())
+
+    # enable CORS TODO: how does this work? Set correctly for prod
+    CORS(flask_app, resources={r'/*': {'origins': '*'}})
+
+    flask_app.register_blueprint(bp)
+    flask_app.extensions['f1analysis'] = _AppState()
+    return flask_app
+
+
+class _AppState:
+    def __init__(self):
+        """Per-process state of an app: data provider, pre-serialized response bodies and in-flight responses"""
+        self.pid = None
+        self.dp = None
+        self.prepared_bodies = None
+        self.flights = None
+        self.lock = threading.Lock()
+
+
+def _get_state(flask_app):
+    state = flask_app.extensions['f1analysis']
+    if state.pid != os.getpid():
+        # first use in this process; objects which were inherited through fork() are not used
+        with state.lock:
+            if state.pid != os.getpid():
+                config = flask_app.config
+                state.dp = DataProvider(config['DB_ADDRESS'],
+                                        cache_size=config['CACHE_SIZE'],
+                                        revision_check_interval=config['REVISION_CHECK_INTERVAL'],
+                                        max_workers=config['QUERY_WORKERS'],
+                                        archive_dir=config['ARCHIVE_DIR'],
+                                        maxPoolSize=config['DB_MAX_POOL_SIZE'],
+                                        minPoolSize=config['DB_MIN_POOL_SIZE'],
+                                        connectTimeoutMS=config['DB_CONNECT_TIMEOUT_MS'],
+                                        serverSelectionTimeoutMS=config['DB_SERVER_SELECTION_TIMEOUT_MS'],
+                                        socketTimeoutMS=config['DB_SOCKET_TIMEOUT_MS'],
+                                        event_listeners=[metrics.command_listener])
+                state.prepared_bodies = LRUCache(config['PREPARED_CACHE_SIZE'])
+                state.flights = SingleFlight()
+                state.pid = os.getpid()
+    return state
+
+
+def get_dataprovider(flask_app=None):
+    """Return the :class:`dataprovider.DataProvider` of an app for the current process.
+
+    It is created on first use in each process. pymongo clients are not fork-safe and may not be shared with a
+    parent process.
+
+    :param flask_app: (optional) the app; default: the current app
+    """
+    return _get_state(flask_app or current_app).dp
+
+
+def init_worker(flask_app):
+    """Connect to the database and preload the most recent sessions (see `WARM_UP_SESSIONS`).
+
+    Call this in each worker process before it accepts requests, e.g. from gunicorn's `post_worker_init` hook.
+
+    :param flask_app: the app
+    :return: list of the ids of the preloaded sessions
+    """
+    sessions = flask_app.config['WARM_UP_SESSIONS']
+    data_provider = get_dataprovider(flask_app)
+    data_provider.check_revisions()
+    if not sessions:
+        return list()
+    return data_provider.warm_up(sessions, channels=flask_app.config['WARM_UP_CHANNELS'])
+
+
+def init_shared_metrics(flask_app):
+    """Let /metrics report the metrics of all worker processes instead of only the one which handles the scrape.
+
+    Call this once in the master process of a pre-fork server before the workers are started, e.g. from gunicorn's
+    `on_starting` hook. The metrics are shared through the directory `METRICS_DIR`; a temporary directory is used
+    if it is not set.
+
+    :param flask_app: the app
+    """
+    if not flask_app.config['METRICS_ENABLED']:
+        return
+    if not flask_app.config['METRICS_DIR']:
+        flask_app.config['METRICS_DIR'] = tempfile.mkdtemp(prefix='f1analysis-metrics-')
+    metrics.share(flask_app.config['METRICS_DIR'], gauges=lambda: metrics_gauges(flask_app))
+
+
+def metrics_gauges(flask_app):
+    """Return the gauges of the current process for /metrics; list of tuples (name, help, value)
+
+    :param flask_app: the app
+    """
+    state = _get_state(flask_app)
+    gauges = [('f1_cache_{}'.format(key), 'Query cache: {}'.format(key), value)
+              for key, value in state.dp.cache.stats().items()]
+    gauges.append(('f1_coalesced_queries', 'Database queries which were shared with a concurrent request',
+                   state.dp.flights.coalesced))
+    gauges.append(('f1_coalesced_responses', 'Response bodies which were shared with a concurrent request',
+                   state.flights.coalesced))
+    return gauges
+
+
+# the data provider, the pre-serialized response bodies (by ETag) and the response bodies which are being built
+# (shared by concurrent identical requests) of the current app and process
+dp = LocalProxy(lambda: get_dataprovider())
+prepared_bodies = LocalProxy(lambda: _get_state(current_app).prepared_bodies)
+flights = LocalProxy(lambda: _get_state(current_app).flights)
+
+
+@bp.before_app_request
+def start_metrics():
+    if current_app.config['METRICS_ENABLED']:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.start_request(endpoint)
+
+
+@bp.after_app_request
+def finish_metrics(response):
+    request_metrics = metrics.current()
+    if request_metrics is None:
+        return response
+
+    response.headers['Server-Timing'] = request_metrics.server_timing()
+    response.headers['Timing-Allow-Origin'] = '*'
+
+    if response.is_streamed:
+        # the body is generated after this function returns; the request is recorded when it is finished
+        response.response = metrics.instrument_stream(response.response, request_metrics)
+    else:
+        request_metrics.response_bytes = response.calculate_content_length() or 0
+        metrics.finish_request(request_metrics)
+    return response
+
+
+@bp.after_app_request
+def compress_response(response):
+    """Compress responses which were not already compressed by the view function.
+
+    This runs before :func:`finish_metrics`, so that the compressed size is recorded.
+    """
+    if not current_app.config['COMPRESSION_ENABLED'] or response.status_code != 200 or response.direct_passthrough:
+        return response
 
+    response.vary.add('Accept-Encoding')
+    if 'Content-Encoding' in response.headers:
+        return response
 
-# connect to database
-dp = DataProvider('mongodb://localhost:27017')
+    coding = negotiate_encoding()
+    if coding is None:
+        return response
 
-# configuration
-DEBUG = True
+    if response.is_streamed:
+        response.response = compression.iter_compress(response.response, coding)
+    else:
+        body = response.get_data()
+        if len(body) < current_app.config['COMPRESSION_MIN_SIZE']:
+            return response
+        response.set_data(compression.compress(body, coding))
+    response.headers['Content-Encoding'] = coding
+    return response
 
-# instantiate the app
-app = Flask(__name__)
-app.config.from_object(__name__)
 
-# enable CORS TODO: how does this work? Set correctly for prod
-CORS(app, resources={r'/*': {'origins': '*'}})
+@bp.teardown_app_request
+def clear_metrics(exc):
+    metrics.clear()
 
 
-@app.route('/info/events', methods=['GET'])
+def negotiate_encoding():
+    """Return the content coding for the current request's response ('br', 'gzip' or None)"""
+    if not current_app.config['COMPRESSION_ENABLED']:
+        return None
+    return compression.negotiate(request.accept_encodings)
+
+
+def make_etag(key):
+    """Return a strong ETag for a tuple which uniquely identifies the content of a response."""
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def set_caching_headers(response, etag, max_age):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response
+
+
+def stored_response(etag, build, mimetype, coding):
+    """Return a response whose body is built (and compressed) only once per ETag and reused afterwards.
+
+    The ETag needs to include the content coding, as each coding is a different representation.
+    Concurrent requests for a body which is not stored yet wait for the first one to build it.
+
+    :param etag: ETag of the response
+    :param build: function which returns the uncompressed body (bytes); only called if the body is not stored yet
+    :param mimetype: mimetype of the response
+    :param coding: content coding returned by :func:`negotiate_encoding`; bodies smaller than
+        `COMPRESSION_MIN_SIZE` are not compressed
+    """
+    entry = prepared_bodies.get(('body', etag))
+    if entry is None:
+        def build_entry():
+            body = build()
+            content_encoding = None
+            if coding is not None and len(body) >= current_app.config['COMPRESSION_MIN_SIZE']:
+                body = compression.compress(body, coding, stored=True)
+                content_encoding = coding
+            prepared_bodies.put(('body', etag), (body, content_encoding))
+            return body, content_encoding
+
+        entry = flights.do(('body', etag), build_entry)
+
+    body, content_encoding = entry
+    response = Response(body, mimetype=mimetype)
+    if content_encoding is not None:
+        response.headers['Content-Encoding'] = content_encoding
+    return response
+
+
+def serialize_success(data):
+    """Return the JSON body of a successful response"""
+    with metrics.measure_serialization():
+        return json.dumps({'data': data, 'status': 'success', 'msg': ''}).encode('utf-8')
+
+
+def prepared_response(key, build, max_age=None):
+    """Return a JSON response with a pre-serialized body, a strong ETag and Cache-Control headers.
+
+    If the request's If-None-Match header matches, 304 (Not Modified) is returned without building the body.
+    Bodies are serialized and compressed once and reused afterwards (see :func:`stored_response`).
+
+    :param key: tuple which uniquely identifies the content; it must change whenever the content changes
+    :param build: function which returns the response's `data`; only called if the body is not cached yet
+    :param max_age: (optional) Cache-Control max-age in seconds; default: `INFO_MAX_AGE`
+    """
+    if max_age is None:
+        max_age = current_app.config['INFO_MAX_AGE']
+
+    coding = negotiate_encoding()
+    etag = make_etag(key + (coding,))
+    if etag in request.if_none_match:
+        return set_caching_headers(Response(status=304), etag, max_age)
+
+    response = stored_response(etag, lambda: serialize_success(build()), 'application/json', coding)
+    return set_caching_headers(response, etag, max_age)
+
+
+@bp.route('/info/events', methods=['GET'])
 def get_events():
-    events = dp.get_events_names()
-    response_obj = {'data': events, 'status': 'success', 'msg': ''}
-    return jsonify(response_obj)
+    dp.check_revisions()
+    return prepared_response(('events', dp.data_version), dp.get_events_names)
 
 
-@app.route('/info/sessions/<eventid>', methods=['GET'])
+@bp.route('/info/sessions/<eventid>', methods=['GET'])
 def get_sessions_for_event(eventid):
-    sessions = dp.get_sessions_names(eventid=eventid)
-    response_obj = {'data': sessions, 'status': 'success', 'msg': ''}
-    return jsonify(response_obj)
+    dp.check_revisions()
+    return prepared_response(('sessions', eventid, dp.data_version),
+                             lambda: dp.get_sessions_names(eventid=eventid))
 
 
-@app.route('/info/drivers', methods=['GET'])
+@bp.route('/info/drivers', methods=['GET'])
 def get_drivers():
-    data = lookuptables.get_driver_abbs()
-    response_obj = {'data': data, 'status': 'success', 'msg': ''}
-    return jsonify(response_obj)
+    season = request.args.get('season', type=int)
+    dp.check_revisions()
+    return prepared_response(('drivers', season, dp.drivers.version),
+                             lambda: dp.drivers.get_abbs(season))
 
 
-@app.route('/info/channels', methods=['GET'])
+@bp.route('/info/channels', methods=['GET'])
 def get_telemetry_channels():
-    response_obj = {'data': lookuptables.json_channel_names, 'status': 'success', 'msg': ''}
-    return jsonify(response_obj)
+    return prepared_response(('channels', channels_version), lambda: lookuptables.json_channel_names)
 
 
-@app.route('/data/telemetry', methods=['POST'])
+@bp.route('/data/telemetry', methods=['POST'])
 def get_telemetry_data():
-    response_object = {'status': 'success', 'msg': ''}
     payload = request.get_json()
 
-    data = dp.get_telemetry_data(payload)
+    request_metrics = metrics.current()
+    if request_metrics is not None:
+        select_by = payload.get('selectBy')
+        request_metrics.select_by = select_by if select_by in ('fastest', 'laps', 'time') else 'invalid'
+
+    return telemetry_response(payload)
+
+
+@bp.route('/data/window', methods=['POST'])
+def get_window_data():
+    payload = request.get_json()
+
+    request_metrics = metrics.current()
+    if request_metrics is not None:
+        request_metrics.select_by = 'window'
+
+    return telemetry_response(payload, clip=True)
+
+
+@bp.route('/data/align', methods=['POST'])
+def get_aligned_laps():
+    payload = request.get_json()
+
+    # aligned laps only change when the session is loaded again (new revision)
+    revision = dp.get_session_revision(payload['session'])
+    if revision is None:
+        return jsonify({'data': dp.get_aligned_laps(payload), 'status': 'success', 'msg': ''})
+
+    coding = negotiate_encoding()
+    etag = make_etag(('align', json.dumps(payload, sort_keys=True), revision, coding))
+    if etag in request.if_none_match:
+        return set_caching_headers(Response(status=304), etag, current_app.config['TELEMETRY_MAX_AGE'])
+
+    response = stored_response(etag, lambda: serialize_success(dp.get_aligned_laps(payload)),
+                               'application/json', coding)
+    return set_caching_headers(response, etag, current_app.config['TELEMETRY_MAX_AGE'])
+
+
+def telemetry_response(payload, clip=False):
+    """Return the response for a telemetry request in the format which is preferred by the client.
+
+    :param payload: request options as specified in the API documentation
+    :param clip: clip the telemetry data to the requested time range (see
+        :meth:`dataprovider.DataProvider.iter_telemetry_data`)
+    """
+    # JSON is the default; the other formats are only used if the client explicitly prefers them
+    mimetype = request.accept_mimetypes.best_match(('application/json', NDJSON_MIMETYPE, encoding.MIMETYPE))
+
+    coding = negotiate_encoding()
+
+    # telemetry data of a session only changes when the session is loaded again (new revision)
+    etag = None
+    request_key = dp.request_key(payload, clip)
+    revision = dp.get_session_revision(payload['session'])
+    if revision is not None:
+        etag = make_etag(('telemetry', request_key, mimetype, revision, coding))
+        if etag in request.if_none_match:
+            response = set_caching_headers(Response(status=304), etag, current_app.config['TELEMETRY_MAX_AGE'])
+            response.vary.add('Accept')
+            return response
+
+    # streamed responses: each lap is sent as soon as its telemetry has been read
+    # (they are compressed on the fly by compress_response)
+    if mimetype == encoding.MIMETYPE:
+        encoding.check_channels(dp.requested_channels(payload))
+        laps = dp.iter_telemetry_data(payload, columnar=True, clip=clip, arrays=True)
+        response = Response(encoding.iter_encode_telemetry(laps), mimetype=encoding.MIMETYPE)
+
+    elif mimetype == NDJSON_MIMETYPE:
+        laps = dp.iter_telemetry_data(payload, clip=clip)
+        response = Response((json.dumps(lap) + '\n' for lap in laps), mimetype=NDJSON_MIMETYPE)
+
+    elif etag is not None:
+        # immutable until the next revision; the (compressed) body is stored and reused
+        # concurrent identical requests share one serialized body, regardless of their content coding
+        def build():
+            return flights.do(('json', request_key, revision),
+                              lambda: serialize_success(dp.get_telemetry_data(payload, clip=clip)))
+        response = stored_response(etag, build, 'application/json', coding)
+
+    else:
+        response_object = {'status': 'success', 'msg': ''}
+        data = dp.get_telemetry_data(payload, clip=clip)
+        response_object['data'] = data
+        with metrics.measure_serialization():
+            response = jsonify(response_object)
+
+    if etag is not None:
+        set_caching_headers(response, etag, current_app.config['TELEMETRY_MAX_AGE'])
+    response.vary.add('Accept')
+    return response
 
-    response_object['data'] = data
 
-    return jsonify(response_object)
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(metrics_gauges(current_app)), mimetype='text/plain; version=0.0.4')
 
 
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
@@ -0,0 +1,280 @@
+"""
+:mod:`archive` - File Archive for Finished Sessions
+===================================================
+
+Sessions which will not change anymore can be exported from MongoDB to a directory of NumPy files
+(see :meth:`dataprovider.DataProvider.export_archive`). The server then reads them from these files
+instead of the database.
+
+Directory layout of an archived session::
+
+    <archive dir>/<session id>/
+        meta.json           format version, session revision, list of channels, channel types
+        timingdata.bson     timing data; one BSON document per lap (same as collection 'timingdata')
+        laps.npy            lap offset index; int64 array with one row (lap id, offset, length) per lap
+        <channel>.npy       one array per telemetry channel with the samples of all laps
+
+The samples of each lap are stored contiguously, laps are ordered by driver and lap number.
+Channel files are memory-mapped. Reading a lap is therefore an index lookup and a slice, no data is loaded
+into memory until it is accessed.
+Missing values are stored as NaN (float channels) or NaT ('Date').
+Boolean channels (e.g. 'Brake') are stored as bool arrays; if values are missing, as float arrays with NaN. meta.json
+lists them under 'dtypes', so that :func:`to_list` returns True/False in both cases, like the database.
+
+If the telemetry data has no 'Date' channel, it is derived from each lap's start date when exporting.
+"""
+
+import json
+import os
+import shutil
+from datetime import datetime
+
+import bson
+import numpy as np
+
+
+FORMAT_VERSION = 2
+
+
+def write_archive(directory, timing, laps, channels, revision):
+    """Write a session archive; an existing archive in `directory` is replaced.
+
+    The archive is written to a temporary directory first, so readers never see a partially written archive.
+
+    :param directory: archive directory of the session
+    :param timing: timing data; list of dicts, one per lap, ordered by driver and lap number
+    :param laps: iterable of tuples (lap id, telemetry), in the same order as `timing`; the telemetry of each lap
+      is a dict of channel arrays
+    :param channels: names of all telemetry channels
+    :param revision: revision of the session which is exported
+    :type directory: str
+    :type channels: list
+    :type revision: int
+    """
+    channels = [name for name in channels if name != 'Date'] + ['Date']
+    lap_starts = {lap['_id']: lap.get('LapStartDate') for lap in timing}
+
+    index = list()
+    columns = {name: list() for name in channels}
+    offset = 0
+    for lap_id, telemetry in laps:
+        length = len(telemetry.get('SessionTime', ()))
+        if not length:
+            continue
+
+        if not telemetry.get('Date'):
+            telemetry = dict(telemetry, Date=_derive_dates(telemetry['SessionTime'], lap_starts.get(lap_id)))
+        for name, values in columns.items():
+            values.extend(telemetry.get(name) or (None, ) * length)
+
+        index.append((lap_id, offset, length))
+        offset += length
+
+    tmp_directory = directory.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+
+    np.save(os.path.join(tmp_directory, 'laps.npy'), np.array(index, dtype=np.int64).reshape(-1, 3))
+    dtypes = dict()
+    for name, values in columns.items():
+        if _is_bool(values):
+            dtypes[name] = 'bool'
+        np.save(os.path.join(tmp_directory, name + '.npy'), _to_array(values, name))
+
+    with open(os.path.join(tmp_directory, 'timingdata.bson'), 'wb') as f:
+        for lap in timing:
+            f.write(bson.encode(lap))
+
+    # written last; an archive without meta.json is ignored
+    with open(os.path.join(tmp_directory, 'meta.json'), 'w') as f:
+        json.dump({'version': FORMAT_VERSION, 'revision': revision, 'channels': channels, 'dtypes': dtypes}, f)
+
+    old_directory = directory.rstrip(os.sep) + '.old'
+    if os.path.exists(directory):
+        os.replace(directory, old_directory)
+    os.replace(tmp_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+
+
+def exists(directory):
+    """Return True if `directory` contains a complete session archive"""
+    return os.path.isfile(os.path.join(directory, 'meta.json'))
+
+
+def _derive_dates(session_time, lap_start_date):
+    if not isinstance(lap_start_date, datetime):
+        return [None] * len(session_time)
+    start = np.datetime64(lap_start_date, 'ms')
+    offsets = np.array(session_time, dtype=float) - session_time[0]
+    return (start + (offsets * 1000).astype('timedelta64[ms]')).tolist()
+
+
+def _is_bool(values):
+    """Return True if all values of a channel are bool or None (at least one bool)"""
+    present = [value for value in values if value is not None]
+    return bool(present) and all(isinstance(value, (bool, np.bool_)) for value in present)
+
+
+def _to_array(values, name):
+    """Convert a channel to an array which can be memory-mapped (no object arrays)"""
+    if name == 'Date':
+        return np.array(values, dtype='datetime64[ms]')  # None becomes NaT
+    if all(isinstance(value, (bool, np.bool_)) for value in values):
+        return np.array(values, dtype=bool)
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        return np.array(values, dtype=np.int64)
+    try:
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array(['' if value is None else str(value) for value in values])
+
+
+def to_list(values, dtype=None):
+    """Convert an array slice to a list of builtin values; NaN and NaT become None
+
+    :param values: array slice
+    :param dtype: (optional) 'bool' for boolean channels which are stored as float (see :attr:`SessionArchive.dtypes`)
+    """
+    if values.dtype.kind == 'f':
+        if dtype == 'bool':
+            return [None if value != value else bool(value) for value in values.tolist()]
+        missing = np.isnan(values)
+        if missing.any():
+            return [None if is_missing else value for value, is_missing in zip(values.tolist(), missing.tolist())]
+    return values.tolist()
+
+
+class SessionArchive:
+    def __init__(self, directory):
+        """Read access to an archived session (see :func:`write_archive`).
+
+        Timing data and the lap offset index are loaded into memory; they are small. Channel files are
+        memory-mapped when they are accessed for the first time.
+
+        :param directory: archive directory of the session
+        :type directory: str
+        """
+        self.directory = directory
+
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError("Unsupported archive format version {} in {}".format(meta['version'], directory))
+        self.revision = meta['revision']
+        self.channels = meta['channels']
+        self.dtypes = meta['dtypes']  # channel name -> 'bool'; only boolean channels are listed
+
+        with open(os.path.join(directory, 'timingdata.bson'), 'rb') as f:
+            self.timing = bson.decode_all(f.read())
+
+        # lap id -> slice of the channel arrays
+        self._laps = {int(lap_id): slice(int(offset), int(offset + length))
+                      for lap_id, offset, length in np.load(os.path.join(directory, 'laps.npy'))}
+
+        # driver number -> slice which covers all laps of the driver
+        self._drivers = dict()
+        for lap in self.timing:
+            lap_slice = self._laps.get(lap['_id'])
+            if lap_slice is None:
+                continue
+            current = self._drivers.get(lap['DriverNumber'], lap_slice)
+            self._drivers[lap['DriverNumber']] = slice(min(current.start, lap_slice.start),
+                                                       max(current.stop, lap_slice.stop))
+
+        self._arrays = dict()  # channel name -> memory-mapped array
+
+    def channel(self, name):
+        """Return the memory-mapped array of a channel (samples of all laps) or None if it does not exist."""
+        if name not in self.channels:
+            return None
+        if name not in self._arrays:
+            # concurrent first accesses may both map the file; that is harmless
+            self._arrays[name] = np.load(os.path.join(self.directory, name + '.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+    def lap_arrays(self, lap_id, filter_channels=()):
+        """Return zero-copy views of the channels of one lap.
+
+        :param lap_id: the laps numeric id
+        :param filter_channels: (optional) a list of channel names; 'SessionTime' is always included
+        :return: dict channel name -> NumPy array (read-only); None if the lap has no telemetry data
+        """
+        lap_slice = self._laps.get(lap_id)
+        if lap_slice is None:
+            return None
+        ret = dict()
+        for name in dict.fromkeys(('SessionTime', ) + tuple(filter_channels)):
+            values = self.channel(name)
+            if values is not None:
+                ret[name] = values[lap_slice]
+        return ret
+
+    def laps_telemetry(self, lap_ids, filter_channels=(), columnar=False, arrays=False):
+        """Return telemetry data of multiple laps in the same format as
+        :meth:`dataprovider.DataProvider.get_laps_telemetry`.
+
+        If `arrays` and `columnar` are True, the channels are returned as zero-copy array views (see
+        :meth:`lap_arrays`) instead of lists. Boolean channels with missing values are float arrays then.
+        """
+        names = list(dict.fromkeys(('SessionTime', ) + tuple(filter_channels)))
+
+        ret = dict()
+        for lap_id in lap_ids:
+            lap_arrays = self.lap_arrays(lap_id, names) or dict()
+            if columnar and arrays:
+                ret[lap_id] = {name: lap_arrays.get(name, list()) for name in names}
+                continue
+
+            lap = {name: to_list(lap_arrays[name], self.dtypes.get(name)) if name in lap_arrays else list()
+                   for name in names}
+            if columnar:
+                ret[lap_id] = lap
+            else:
+                available = [name for name in names if name in lap_arrays]
+                ret[lap_id] = [dict(zip(available, values)) for values in zip(*(lap[name] for name in available))]
+        return ret
+
+    def timing_data(self, drivernumbers, lap=(), timerange=(), starts_in=True, ends_in=True):
+        """Return timing data; same filter options and results as
+        :meth:`dataprovider.DataProvider.get_timing_data_multi`.
+
+        The fastest lap is determined numerically; laps without a lap time ('inf') are ignored.
+        """
+        numbers = set(drivernumbers)
+        laps = [itm for itm in self.timing if itm['DriverNumber'] in numbers]
+
+        if lap == 'fastest':
+            fastest = dict()
+            for itm in laps:
+                if isinstance(itm['LapTime'], (int, float)) and itm['LapTime'] == itm['LapTime']:  # not NaN
+                    current = fastest.get(itm['DriverNumber'])
+                    if current is None or itm['LapTime'] < current['LapTime']:
+                        fastest[itm['DriverNumber']] = itm
+            return list(fastest.values())
+
+        if lap:
+            lap_numbers = set(lap) if isinstance(lap, (tuple, list)) else {lap}
+            return [itm for itm in laps if itm['LapNumber'] in lap_numbers]
+
+        start, end = timerange
+        ret = list()
+        for itm in laps:
+            if starts_in and not (isinstance(itm['LapStartDate'], datetime) and start <= itm['LapStartDate'] <= end):
+                continue
+            if ends_in and not (isinstance(itm['LapEndDate'], datetime) and start <= itm['LapEndDate'] <= end):
+                continue
+            ret.append(itm)
+        return ret
+
+    def time_range(self, drivernumber, channel, starttime, endtime):
+        """Return the samples of one driver and channel with starttime <= 'Date' < endtime.
+
+        :return: dict {'time': array of datetime64, `channel`: array}; both empty if nothing matches
+        """
+        driver_slice = self._drivers.get(drivernumber, slice(0, 0))
+        dates = self.channel('Date')[driver_slice]
+        mask = (dates >= np.datetime64(starttime, 'ms')) & (dates < np.datetime64(endtime, 'ms'))
+
+        values = self.channel(channel)
+        return {'time': dates[mask],
+                channel: values[driver_slice][mask] if values is not None else np.empty(0)}
@@ -0,0 +1,168 @@
+"""
+:mod:`cache` - In-Process Cache
+===============================
+
+This module provides a memory bounded LRU cache for immutable query results and a single-flight
+helper which lets concurrent identical requests share one computation.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, max_bytes):
+        """Thread safe least-recently-used cache with a size limit in bytes.
+
+        Keys need to be tuples where the first item is a session id. This allows
+        removing all entries which belong to one session at once.
+
+        The size of each value is estimated when it is added. Cached values are shared
+        between all callers and must therefore be treated as read-only.
+
+        :param max_bytes: approximate upper limit for the memory used by cached values; 0 disables the cache
+        :type max_bytes: int
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._data = OrderedDict()  # key -> (value, size)
+        self._sessions = dict()  # session id -> set of keys
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for a key or `default` if the key is not cached."""
+        with self._lock:
+            try:
+                value, _ = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Add a value to the cache. Least recently used entries are evicted if necessary.
+
+        Values which are larger than the whole cache are not stored.
+        """
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+            self._data[key] = (value, size)
+            self._sessions.setdefault(key[0], set()).add(key)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate_session(self, session_id):
+        """Remove all entries which belong to a session."""
+        with self._lock:
+            for key in list(self._sessions.get(session_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._data.clear()
+            self._sessions.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return a dict of cache statistics (hits, misses, evictions, items, size, max_bytes)."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'items': len(self._data), 'size': self.size, 'max_bytes': self.max_bytes}
+
+    def _remove(self, key):
+        _, size = self._data.pop(key)
+        self.size -= size
+        keys = self._sessions[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._sessions[key[0]]
+
+
+class SingleFlight:
+    def __init__(self):
+        """Coalesces concurrent calls with the same key into one call.
+
+        The first caller of :meth:`do` for a key runs the function. Callers which arrive with the same key while it
+        is running wait for it and receive the same result (or the same exception). Results are not kept afterwards;
+        use a cache for that.
+        """
+        self.coalesced = 0  # number of calls which waited for another call instead of running the function
+
+        self._calls = dict()  # key -> _Call
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """Run `function` or wait for a running call with the same key and return its result.
+
+        :param key: hashable key which identifies the result of `function`
+        :param function: function without arguments
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def estimate_size(obj):
+    """Return the approximate memory usage of an object in bytes, including all contained objects.
+
+    Lists and tuples of scalar values (e.g. telemetry channels) are estimated from their first item.
+    """
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += estimate_size(key) + estimate_size(value)
+
+    elif isinstance(obj, (list, tuple)) and obj:
+        if isinstance(obj[0], (int, float, bool)) or obj[0] is None:
+            size += sys.getsizeof(obj[0]) * len(obj)
+        else:
+            size += sum(estimate_size(item) for item in obj)
+
+    return size
@@ -0,0 +1,79 @@
+"""
+:mod:`compression` - Response Compression
+=========================================
+
+Content-Encoding negotiation and compression of response bodies.
+
+gzip is always available. Brotli is used if the optional ``brotli`` module is installed and the client
+prefers it.
+
+Bodies which are stored and reused (see :func:`app.stored_response`) are compressed once with a higher
+compression level. Streamed bodies are compressed chunk by chunk with a faster level.
+"""
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# compression levels: (streamed / per request, stored)
+GZIP_LEVELS = (6, 9)
+BROTLI_QUALITIES = (5, 9)
+
+
+def negotiate(accept_encodings):
+    """Return the content coding which should be used for a response.
+
+    :param accept_encodings: parsed Accept-Encoding header (werkzeug.datastructures.Accept)
+    :return: 'br', 'gzip' or None if the response should not be compressed
+    """
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def compress(data, coding, stored=False):
+    """Compress a complete body.
+
+    :param data: body
+    :type data: bytes
+    :param coding: 'br' or 'gzip'
+    :param stored: use the higher compression level for bodies which are compressed once and stored
+    :rtype: bytes
+    """
+    if coding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITIES[stored])
+    elif coding == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVELS[stored], zlib.DEFLATED, 31)  # wbits 31: gzip container
+        return compressor.compress(data) + compressor.flush()
+    raise ValueError("Unsupported content coding: {}".format(coding))
+
+
+def iter_compress(chunks, coding):
+    """Compress a streamed body.
+
+    Each chunk is flushed, so that the client receives it immediately (e.g. one lap per chunk).
+
+    :param chunks: iterable of str or bytes
+    :param coding: 'br' or 'gzip'
+    :return: generator of compressed chunks
+    """
+    if coding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITIES[0])
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    elif coding == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVELS[0], zlib.DEFLATED, 31)
+        process, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    else:
+        raise ValueError("Unsupported content coding: {}".format(coding))
+
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = process(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
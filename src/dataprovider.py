@@ -5,26 +5,96 @@
 This module provides an interface to the backend database.
 """
 
+import contextvars
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pymongo
-from lookuptables import driver_query
+from lookuptables import DriverRegistry
 from datetime import datetime
 
+import archive
+from cache import LRUCache, SingleFlight
+from lapindex import LapIntervalIndex
+import processing
+
 
 class DataProvider:
-    def __init__(self, address):
+    # indexes which support the queries of this class; collection name -> list of index keys
+    SESSION_INDEXES = {
+        'timingdata': [[('DriverNumber', 1), ('LapTime', 1)],
+                       [('DriverNumber', 1), ('LapNumber', 1)],
+                       [('DriverNumber', 1), ('LapStartDate', 1), ('LapEndDate', 1)],
+                       [('DriverNumber', 1), ('LapEndDate', 1)]],
+        'telemetry': [[('LapId', 1)]],
+    }
+
+    # maximum number of grid points for aligned laps (see get_aligned_laps)
+    MAX_ALIGN_POINTS = 10000
+
+    def __init__(self, address, cache_size=256 * 1024 ** 2, revision_check_interval=60, max_workers=4,
+                 archive_dir=None, **client_options):
         """MongoDB wrapper class
 
         Should make database requests easier and make them look nicer.
 
+        Timing data and telemetry data of a session do not change after the session has been loaded into the
+        database. Query results are therefore cached in memory (see :attr:`cache`). Identical queries which are
+        requested concurrently (e.g. by many clients right after a session has been loaded) are coalesced into one
+        database query (see :attr:`flights`). When a session is loaded again,
+        the populate scripts increment the session's `revision`. Revisions are checked at most every
+        `revision_check_interval` seconds and cached data of changed sessions is discarded.
+
+        When telemetry data for multiple drivers is requested, one query per driver is run concurrently on a pool
+        of up to `max_workers` threads (pymongo's client is thread safe).
+
+        Sessions which have been exported to `archive_dir` (see :meth:`export_archive` and module :mod:`archive`)
+        are read from memory-mapped files instead of the database. Their data is not cached, as reading it is
+        cheap. An archive is only used while its revision matches the session's revision in the database.
+
         :param address: server address
+        :param cache_size: (optional) size limit of the cache in bytes; 0 disables caching
+        :param revision_check_interval: (optional) minimum time between checks for changed sessions in seconds
+        :param max_workers: (optional) maximum number of concurrent telemetry queries per request;
+          1 runs all queries sequentially
+        :param archive_dir: (optional) directory which contains archived sessions
+        :param client_options: (optional) keyword arguments which are passed to pymongo.MongoClient
+
         :type address: str
+        :type cache_size: int
+        :type revision_check_interval: int or float
+        :type max_workers: int
+        :type archive_dir: str
         """
-        self._dbclient = pymongo.MongoClient(address)
+        self._dbclient = pymongo.MongoClient(address, **client_options)
         self._f1info_db = self._dbclient['F1Info']
         self._events = self._f1info_db['Events']
         self._sessions = self._f1info_db['Sessions']
         self._drivers = self._f1info_db['Drivers']
 
+        self._telemetry_layouts = dict()  # session id -> 'rows' or 'columnar'
+
+        self._archive_dir = archive_dir
+        self._archives = dict()  # session id -> archive.SessionArchive or None
+
+        # driver rosters per season; loaded from the database together with the session revisions
+        self.drivers = DriverRegistry()
+
+        self.cache = LRUCache(cache_size)
+        self.flights = SingleFlight()  # concurrent identical database queries share one query
+        self._revisions = dict()  # session id -> revision
+        self.data_version = None  # changes whenever a session is added or loaded again
+        self._revision_check_interval = revision_check_interval
+        self._revisions_checked = None
+        self._revision_lock = threading.Lock()
+
+        self._max_workers = max_workers
+        self._executor = None  # created on first use
+        self._executor_lock = threading.Lock()
+
     def get_events_names(self, **kwargs):
         """ Return a list of event names and ids
 
@@ -50,43 +120,324 @@ class DataProvider:
         filter_dict = {'_id': 0, key: 1}
         return self._sessions.find_one({'id': sessionid}, filter_dict)[key]
 
-    def get_telemetry_data(self, options):
+    def get_telemetry_data(self, options, columnar=False, clip=False):
         """Return telemetry data for multiple drivers and laps.
 
         :param options: request options as specified in the API documentation for `Request Data (/data/telemetry)`
+        :param columnar: (optional) return the telemetry of each lap as dict of channel arrays instead of a list of samples
+        :param clip: (optional) return only the samples within the time range of the options;
+          see :meth:`iter_telemetry_data`
         """
-        ret = list()
+        return list(self.iter_telemetry_data(options, columnar=columnar, chunk_size=0, clip=clip))
+
+    def iter_telemetry_data(self, options, columnar=False, chunk_size=8, clip=False, arrays=False):
+        """Return a generator which yields telemetry data for multiple drivers and laps one lap at a time.
+
+        Laps are selected immediately, invalid options raise an exception when calling this method.
+        Telemetry data is then fetched lazily in chunks of `chunk_size` laps (one query per chunk and driver,
+        run concurrently).
+        The laps are yielded in the same order as they are returned by :meth:`get_telemetry_data`.
+
+        If `clip` is True, all laps which overlap the time range given by 'timeStartValue' and 'timeEndValue' are
+        selected ('selectBy', 'timeStartIn' and 'timeEndIn' are ignored). Only the samples within the time range are
+        returned for each lap.
+
+        :param options: request options as specified in the API documentation for `Request Data (/data/telemetry)`
+        :param columnar: (optional) yield the telemetry of each lap as dict of channel arrays instead of a list of samples
+        :param chunk_size: (optional) number of laps which are fetched per query; 0 fetches all laps with one query
+        :param clip: (optional) clip the telemetry data to the requested time range
+        :param arrays: (optional, with `columnar` only) the channels of archived sessions may be NumPy arrays
+          instead of lists; for consumers which do not need builtin values (e.g. :mod:`encoding`)
+        """
+        sid = options['session']
+        channels = self.requested_channels(options)
+        laps = self._select_laps(options, clip=clip)
+        if clip:
+            start, end = self._time_window(options)
+        if not chunk_size:
+            chunk_size = max(len(laps), 1)
+
+        max_points = options.get('maxPoints')
+        if max_points is not None and (not isinstance(max_points, int) or max_points < 2):
+            raise ValueError("Invalid value for 'maxPoints': {}".format(max_points))
+
+        def generator():
+            for i in range(0, len(laps), chunk_size):
+                chunk = laps[i:i + chunk_size]
+                telemetry = self._fetch_telemetry_concurrently(sid, chunk, channels, columnar, arrays=arrays)
+                for driver, lap in chunk:
+                    lap_telemetry = telemetry[lap['_id']]
+                    if clip:
+                        lap_telemetry = processing.clip(lap_telemetry,
+                                                        *_session_time_window(lap, lap_telemetry, start, end))
+                    if max_points:
+                        lap_telemetry = processing.downsample(lap_telemetry, max_points)
+                    yield {'driver': driver, 'telemetry': lap_telemetry,
+                           'laptime': lap['LapTime'], 'lapnumber': lap['LapNumber']}
+
+        return generator()
+
+    @staticmethod
+    def requested_channels(options):
+        """Return the requested channel names ('channel' may be a single name or a list of names) as tuple"""
+        channels = options['channel']
+        if isinstance(channels, str):
+            channels = (channels, )
+        if not isinstance(channels, (list, tuple)) or not channels \
+                or not all(isinstance(name, str) for name in channels):
+            raise ValueError("Invalid value for 'channel': {}".format(channels))
+        return tuple(dict.fromkeys(channels))
+
+    @staticmethod
+    def request_key(options, clip=False):
+        """Return a normalized key for telemetry request options.
+
+        Requests which select the same data have the same key, regardless of unused options and of their order.
+
+        :param options: request options as specified in the API documentation for `Request Data (/data/telemetry)`
+        :param clip: (optional) see :meth:`iter_telemetry_data`
+        :rtype: tuple
+        """
+        select_by = 'window' if clip else options.get('selectBy')
+        if select_by == 'laps':
+            selection = (options.get('laps'), )
+        elif select_by in ('time', 'window'):
+            selection = (options.get('timeStartValue'), options.get('timeEndValue'))
+            if select_by == 'time':
+                selection += (bool(options.get('timeStartIn')), bool(options.get('timeEndIn')))
+        else:
+            selection = ()
+
+        channels = options.get('channel')
+        if isinstance(channels, str):
+            channels = [channels]
 
-        ch_name = options['channel']
+        # values are converted using repr(), so that the key is hashable for any (even invalid) options
+        return (repr(options.get('session')), repr(options.get('drivers')), repr(channels),
+                repr(select_by), repr(selection), repr(options.get('maxPoints')))
+
+    def get_aligned_laps(self, options):
+        """Return telemetry data of multiple laps, resampled onto one common grid (see :func:`processing.align`).
+
+        :param options: request options as specified in the API documentation for `Aligned Laps (/data/align)`
+        :return: dict {'axis': ..., 'grid': [...], 'laps': [{'driver', 'lapnumber', 'laptime', 'telemetry'}, ...]};
+          laps are in the order of request, laps which do not exist are omitted
+        """
         sid = options['session']
 
-        for driver in options['drivers']:
-            driver_number = driver_query(by='Abb', value=driver, get='Number')
+        points = options.get('points')
+        if not isinstance(points, int) or not 2 <= points <= self.MAX_ALIGN_POINTS:
+            raise ValueError("Invalid value for 'points': {}".format(points))
+
+        axis = options.get('axis', 'time')
+        channels = options['channels']
+        if isinstance(channels, str):
+            channels = [channels]
+        if not channels or not all(isinstance(name, str) for name in channels):
+            raise ValueError("Invalid value for 'channels': {}".format(channels))
+        channels = list(dict.fromkeys(channels))
+
+        requested = [(pair['driver'], pair['lap']) for pair in options['laps']]
+        drivers = list(dict.fromkeys(driver for driver, _ in requested))
+        lap_numbers = list(dict.fromkeys(lap for _, lap in requested if lap != 'fastest'))
+
+        # all laps are selected with at most two lookups; lap numbers for all drivers at once
+        selected = dict()
+        if lap_numbers:
+            for driver, lap in self._select_laps({'session': sid, 'drivers': drivers, 'selectBy': 'laps',
+                                                  'laps': lap_numbers}):
+                selected[(driver, lap['LapNumber'])] = lap
+        fastest_drivers = list(dict.fromkeys(driver for driver, lap in requested if lap == 'fastest'))
+        if fastest_drivers:
+            for driver, lap in self._select_laps({'session': sid, 'drivers': fastest_drivers, 'selectBy': 'fastest'}):
+                selected[(driver, 'fastest')] = lap
+
+        laps = [(driver, selected[(driver, lap)]) for driver, lap in requested if (driver, lap) in selected]
+
+        filter_channels = channels + ['Speed'] if axis == 'distance' else channels
+        telemetry = self._fetch_telemetry_concurrently(sid, laps, filter_channels, columnar=True)
+        grid, aligned = processing.align([telemetry[lap['_id']] for _, lap in laps], channels, points, axis)
+
+        return {'axis': axis,
+                'grid': grid,
+                'laps': [{'driver': driver, 'lapnumber': lap['LapNumber'], 'laptime': lap['LapTime'],
+                          'telemetry': values}
+                         for (driver, lap), values in zip(laps, aligned)]}
+
+    def _fetch_telemetry_concurrently(self, session_id, laps, filter_channels, columnar, arrays=False):
+        """Fetch telemetry data with one query per driver; the queries run concurrently.
+
+        :param laps: list of tuples (driver, lap timing data)
+        :param arrays: (optional) see :meth:`get_laps_telemetry`
+        :return: dict which maps each lap id to its telemetry data
+        """
+        lap_ids_by_driver = dict()
+        for driver, lap in laps:
+            lap_ids_by_driver.setdefault(driver, list()).append(lap['_id'])
+
+        if self._max_workers <= 1 or len(lap_ids_by_driver) <= 1:
+            return self.get_laps_telemetry(session_id, [lap['_id'] for _, lap in laps], filter_channels, columnar,
+                                           arrays)
+
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+
+        # the context is passed on so that queries are attributed to the current request (see module metrics)
+        futures = [self._executor.submit(contextvars.copy_context().run,
+                                         self.get_laps_telemetry, session_id, lap_ids, filter_channels, columnar,
+                                         arrays)
+                   for lap_ids in lap_ids_by_driver.values()]
+
+        ret = dict()
+        for future in futures:
+            ret.update(future.result())
+        return ret
+
+    def _select_laps(self, options, clip=False):
+        """Return the timing data of all laps which are selected by the request options.
 
-            if options['selectBy'] == 'fastest':
-                timing_data = self.get_timing_data(sid, driver_number, lap='fastest')
+        If `clip` is True, all laps which overlap the requested time range are selected.
 
-            elif options['selectBy'] == 'time':
-                # currently everything works in UTC; event local time might be preferred for later
-                start = datetime.utcfromtimestamp(options['timeStartValue'] / 1000)
-                end = datetime.utcfromtimestamp(options['timeEndValue'] / 1000)
-                timing_data = self.get_timing_data(sid,
-                                                   driver_number,
-                                                   timerange=(start, end),
-                                                   starts_in=bool(options['timeStartIn']),
-                                                   ends_in=bool(options['timeEndIn']))
+        :return: list of tuples (driver, lap timing data), ordered by driver (in order of request) and lap
+        """
+        sid = options['session']
 
-            elif options['selectBy'] == 'laps':
-                timing_data = self.get_timing_data(sid, driver_number, lap=options['laps'])
+        self.check_revisions()
+        season = _session_season(sid)
+        driver_numbers = [self.drivers.lookup(by='Abb', value=driver, get='Number', season=season)
+                          for driver in options['drivers']]
 
+        # fastest laps and lap numbers are resolved from the lap summary if the session has one
+        # ('selectBy' is not used for time windows and may be missing)
+        summary = self.get_lap_summary(sid) if not clip and options.get('selectBy') in ('fastest', 'laps') else None
+
+        if clip:
+            start, end = self._time_window(options)
+            timing_data = self.get_lap_index(sid).find(start, end, starts_in=False, ends_in=False,
+                                                       drivernumbers=driver_numbers)
+
+        elif options['selectBy'] == 'fastest':
+            if summary is not None:
+                timing_data = self._summary_laps(summary, driver_numbers, 'fastest')
+            else:
+                timing_data = self.get_timing_data_multi(sid, driver_numbers, lap='fastest')
+
+        elif options['selectBy'] == 'time':
+            start, end = self._time_window(options)
+            timing_data = self.get_timing_data_multi(sid,
+                                                     driver_numbers,
+                                                     timerange=(start, end),
+                                                     starts_in=bool(options['timeStartIn']),
+                                                     ends_in=bool(options['timeEndIn']))
+
+        elif options['selectBy'] == 'laps':
+            if summary is not None:
+                timing_data = self._summary_laps(summary, driver_numbers, options['laps'])
             else:
-                raise ValueError("Invalid value for 'selectBy': {}".format(options['selectBy']))
+                timing_data = self.get_timing_data_multi(sid, driver_numbers, lap=options['laps'])
+
+        else:
+            raise ValueError("Invalid value for 'selectBy': {}".format(options['selectBy']))
+
+        laps_by_driver = dict()
+        for lap in timing_data:
+            laps_by_driver.setdefault(lap['DriverNumber'], list()).append(lap)
+
+        ret = list()
+        for driver, driver_number in zip(options['drivers'], driver_numbers):
+            for lap in laps_by_driver.get(driver_number, ()):
+                ret.append((driver, lap))
+
+        return ret
 
-            for lap in timing_data:
-                lap_id = lap['_id']  # list should always only have one item
-                telemetry = self.get_lap_telemetry(sid, lap_id, filter_channels=(ch_name,))
-                ret.append({'driver': driver, 'telemetry': telemetry, 'laptime': lap['LapTime'], 'lapnumber': lap['LapNumber']})
+    @staticmethod
+    def _time_window(options):
+        """Return the requested time range (start, end) as datetimes"""
+        # currently everything works in UTC; event local time might be preferred for later
+        start = datetime.utcfromtimestamp(options['timeStartValue'] / 1000)
+        end = datetime.utcfromtimestamp(options['timeEndValue'] / 1000)
+        if end < start:
+            raise ValueError("'timeEndValue' needs to be greater than 'timeStartValue'")
+        return start, end
 
+    def get_lap_index(self, session_id):
+        """Return the :class:`lapindex.LapIntervalIndex` over the start and end dates of all laps of a session.
+
+        The index is built from the session's timing data once and then cached until the session is loaded again.
+
+        :param session_id: the sessions unique id
+        :type session_id: str
+        """
+        self.check_revisions()
+        index = self.cache.get((session_id, 'lapindex'))
+        if index is None:
+            index = self.flights.do((session_id, 'lapindex'), lambda: self._build_lap_index(session_id))
+        return index
+
+    def _build_lap_index(self, session_id):
+        session_archive = self.get_archive(session_id)
+        if session_archive is not None:
+            laps = session_archive.timing
+        else:
+            laps = list(self._dbclient[session_id]['timingdata'].find({}, {'TimingHash': 0, 'TelemetryHash': 0}))
+        index = LapIntervalIndex(laps)
+        self.cache.put((session_id, 'lapindex'), index)
+        return index
+
+    def get_lap_summary(self, session_id):
+        """Return the lap summary of a session or None if the session has no summary.
+
+        The summary is created by the populate script (collection 'lapsummary'). It is loaded once and then
+        cached until the session is loaded again.
+
+        :param session_id: the sessions unique id
+        :type session_id: str
+        :return: dict which maps each driver number to a dict
+          {'fastest': lap or None, 'count': number of laps, 'laps': dict lap number -> lap};
+          each lap is a dict with the keys '_id', 'DriverNumber', 'LapNumber', 'LapTime', 'LapStartDate', 'LapEndDate'
+        """
+        if self.get_archive(session_id) is not None:
+            return None  # laps are resolved from the archive's timing data
+
+        self.check_revisions()
+        summary = self.cache.get((session_id, 'summary'))
+        if summary is None:
+            summary = self.flights.do((session_id, 'summary'), lambda: self._load_lap_summary(session_id))
+        return summary or None
+
+    def _load_lap_summary(self, session_id):
+        summary = dict()
+        doc = self._dbclient[session_id]['lapsummary'].find_one({'_id': 'summary'})
+        for driver in (doc['drivers'] if doc is not None else ()):
+            laps = dict()
+            for lap in driver['Laps']:
+                lap['DriverNumber'] = driver['DriverNumber']
+                laps[lap['LapNumber']] = lap
+            fastest = [lap for lap in driver['Laps'] if lap['_id'] == driver['FastestLapId']]
+            summary[driver['DriverNumber']] = {'fastest': fastest[0] if fastest else None,
+                                               'count': driver['LapCount'],
+                                               'laps': laps}
+        self.cache.put((session_id, 'summary'), summary)
+        return summary
+
+    def _summary_laps(self, summary, drivernumbers, lap):
+        """Resolve laps (fastest or by lap number, same as :meth:`get_timing_data_multi`) from a lap summary"""
+        self._timing_query(drivernumbers, lap, (), True, True)  # validates `lap`
+        if isinstance(lap, (int, float)):
+            lap = (lap, )
+
+        ret = list()
+        for number in dict.fromkeys(drivernumbers):
+            driver = summary.get(number)
+            if driver is None:
+                continue
+            if lap == 'fastest':
+                if driver['fastest'] is not None:
+                    ret.append(driver['fastest'])
+            else:
+                ret.extend(driver['laps'][lap_number] for lap_number in sorted(set(lap))
+                           if lap_number in driver['laps'])
         return ret
 
     def get_time_range(self, session_id, carnumber, datatype, channel, starttime, endtime):
@@ -107,8 +458,16 @@ class DataProvider:
         :type endtime: datetime or pandas.Timestamp
 
         :return: PyMongo Cursor for the selected time range and for the selected car.
-          Results are filtered so they only contain the time and the selected channel
+          Results are filtered so they only contain the time and the selected channel.
+          For archived sessions, a list of dicts {'time': ..., channel: ...} is returned; `datatype` is ignored.
         """
+        session_archive = self.get_archive(session_id)
+        if session_archive is not None:
+            samples = session_archive.time_range(carnumber, channel, starttime, endtime)
+            return [{'time': time_value, channel: value}
+                    for time_value, value in zip(samples['time'].tolist(),
+                                                 archive.to_list(samples[channel], session_archive.dtypes.get(channel)))]
+
         session = self._dbclient[session_id]
         collection = session[carnumber + '-' + datatype]
         channel_filter = {'_id': 0, 'time': 1, channel: 1}
@@ -128,19 +487,89 @@ class DataProvider:
         :param ends_in: (optional, `with timerange only`) whether the laps needs to end in the specified time range (default: True)
 
         `starts_in` and `ends_in` may not both be false!
+
+        The returned data may be shared with the cache and must not be modified.
+        """
+        return self.get_timing_data_multi(session_id, (drivernumber, ), lap=lap, timerange=timerange,
+                                          starts_in=starts_in, ends_in=ends_in)
+
+    def get_timing_data_multi(self, session_id, drivernumbers, lap=(), timerange=(), starts_in=True, ends_in=True):
+        """Return timing data for multiple drivers using a single database query.
+
+        Accepts the same filter options as :meth:`get_timing_data`, but takes a list of driver numbers.
+        If `lap` is "fastest", the fastest lap of each driver is returned.
+
+        :param session_id: the sessions unique id
+        :param drivernumbers: a list of driver numbers
         """
         assert not (lap and timerange), "Parameters Lap and Timerange are mutually exclusive"
         assert lap or timerange, "Either parameter Lap or Timerange needs to be specified"
 
+        if timerange:
+            self._timing_query(drivernumbers, lap, timerange, starts_in, ends_in)  # validates the options
+            return self.get_lap_index(session_id).find(timerange[0], timerange[1], starts_in, ends_in, drivernumbers)
+
+        session_archive = self.get_archive(session_id)
+        if session_archive is not None:
+            self._timing_query(drivernumbers, lap, timerange, starts_in, ends_in)  # validates the options
+            return session_archive.timing_data(drivernumbers, lap, timerange, starts_in, ends_in)
+
+        self.check_revisions()
+        if lap == 'fastest':
+            return self._fastest_laps(session_id, drivernumbers)
+
+        cache_key = (session_id, 'timing', tuple(drivernumbers), tuple(lap) if isinstance(lap, list) else lap,
+                     tuple(timerange), starts_in, ends_in)
+        timing_data = self.cache.get(cache_key)
+        if timing_data is None:
+            def query():
+                data = self._query_timing_data(session_id, drivernumbers, lap, timerange, starts_in, ends_in)
+                self.cache.put(cache_key, data)
+                return data
+            timing_data = self.flights.do(cache_key, query)
+
+        return timing_data
+
+    def _fastest_laps(self, session_id, drivernumbers):
+        """Return the fastest lap of each driver, in order of `drivernumbers`.
+
+        Laps are cached per driver, so that requests for any combination of drivers (and the warm-up) share them.
+        Only drivers whose fastest lap is not cached are queried.
+        """
+        drivernumbers = list(dict.fromkeys(drivernumbers))
+        fastest = {number: self.cache.get((session_id, 'fastest', number)) for number in drivernumbers}
+        missing = [number for number, laps in fastest.items() if laps is None]
+
+        if missing:
+            def query():
+                data = self._query_timing_data(session_id, missing, 'fastest', (), True, True)
+                laps = {number: [lap for lap in data if lap['DriverNumber'] == number] for number in missing}
+                for number, driver_laps in laps.items():
+                    self.cache.put((session_id, 'fastest', number), driver_laps)  # empty: driver has no lap time
+                return laps
+            fastest.update(self.flights.do((session_id, 'fastest', tuple(missing)), query))
+
+        return [lap for number in drivernumbers for lap in fastest[number]]
+
+    def _query_timing_data(self, session_id, drivernumbers, lap, timerange, starts_in, ends_in):
         collection = self._dbclient[session_id]['timingdata']
+        query = self._timing_query(drivernumbers, lap, timerange, starts_in, ends_in)
+
+        if lap == 'fastest':
+            return list(collection.aggregate(self._fastest_lap_pipeline(query)))
+        return list(collection.find(query))
+
+    @staticmethod
+    def _timing_query(drivernumbers, lap, timerange, starts_in, ends_in):
+        query = {'DriverNumber': {'$in': list(drivernumbers)}}
 
         if lap:
             if lap == 'fastest':
-                timing_data = list(collection.find({'DriverNumber': drivernumber}).sort('LapTime', 1).limit(1))
+                pass  # see _fastest_lap_pipeline
             elif isinstance(lap, (tuple, list)) and all(isinstance(itm, (int, float)) for itm in lap):
-                timing_data = list(collection.find({'DriverNumber': drivernumber, 'LapNumber': {'$in': lap}}))
+                query['LapNumber'] = {'$in': list(lap)}
             elif isinstance(lap, (int, float)):
-                timing_data = list(collection.find({'DriverNumber': drivernumber, 'LapNumber': lap}))
+                query['LapNumber'] = lap
             else:
                 raise ValueError("Invalid value for lap: {}".format(lap))
 
@@ -148,24 +577,22 @@ class DataProvider:
             start = timerange[0]
             end = timerange[1]
 
-            if starts_in and ends_in:
-                timing_data = list(collection.find({'$and': [{'LapStartDate': {'$gte': start}},
-                                                             {'LapStartDate': {'$lte': end}},
-                                                             {'LapEndDate': {'$gte': start}},
-                                                             {'LapEndDate': {'$lte': end}},
-                                                             {'DriverNumber': drivernumber}]}))
-            elif starts_in:
-                timing_data = list(collection.find({'$and': [{'LapStartDate': {'$gte': start}},
-                                                   {'LapStartDate': {'$lte': end}},
-                                                   {'DriverNumber': drivernumber}]}))
-            elif ends_in:
-                timing_data = list(collection.find({'$and': [{'LapEndDate': {'$gte': start}},
-                                                   {'LapEndDate': {'$lte': end}},
-                                                   {'DriverNumber': drivernumber}]}))
-            else:
+            if not (starts_in or ends_in):
                 raise ValueError("starts_in and ends_in can not both be false")
+            if starts_in:
+                query['LapStartDate'] = {'$gte': start, '$lte': end}
+            if ends_in:
+                query['LapEndDate'] = {'$gte': start, '$lte': end}
 
-        return timing_data
+        return query
+
+    @staticmethod
+    def _fastest_lap_pipeline(query):
+        # 'inf' placeholders are strings; these are sorted after all numeric lap times by mongodb
+        return [{'$match': query},
+                {'$sort': {'DriverNumber': 1, 'LapTime': 1}},
+                {'$group': {'_id': '$DriverNumber', 'lap': {'$first': '$$ROOT'}}},
+                {'$replaceRoot': {'newRoot': '$lap'}}]
 
     def get_lap_telemetry(self, session_id, lap_id, filter_channels=()):
         """Return one or multiple telemetry data channels for one lap.
@@ -178,13 +605,340 @@ class DataProvider:
         :type lap_id: int
         :type filter_channels: list or tuple
         """
-        channels = {'_id': 0, 'SessionTime': 1}
+        return self.get_laps_telemetry(session_id, (lap_id, ), filter_channels)[lap_id]
+
+    def get_laps_telemetry(self, session_id, lap_ids, filter_channels=(), columnar=False, arrays=False):
+        """Return one or multiple telemetry data channels for multiple laps using a single database query.
+
+        Laps which are cached are not requested from the database.
+        The returned data may be shared with the cache and must not be modified.
+
+        :param session_id: the sessions unique id
+        :param lap_ids: a list of numeric lap ids
+        :param filter_channels: (optional) a list of channel names
+        :param columnar: (optional) return the telemetry of each lap as dict of channel arrays,
+          e.g. {'SessionTime': [...], 'Speed': [...]}, instead of a list of samples
+
+        :type session_id: str
+        :type lap_ids: list or tuple
+        :type filter_channels: list or tuple
+        :param arrays: (optional, with `columnar` only) return the channels of archived sessions as read-only NumPy
+          arrays (views of the archive's files) instead of lists; this avoids converting them sample by sample
+        :type columnar: bool
+        :type arrays: bool
+
+        :return: dict which maps each lap id to its telemetry data (same format as returned by :meth:`get_lap_telemetry`)
+        """
+        session_archive = self.get_archive(session_id)
+        if session_archive is not None:
+            return session_archive.laps_telemetry(lap_ids, filter_channels, columnar, arrays)
+
+        self.check_revisions()
+        channel_set = tuple(sorted(set(filter_channels)))
+
+        ret = dict()
+        missing = list()
+        for lap_id in lap_ids:
+            telemetry = self.cache.get((session_id, 'telemetry', lap_id, channel_set, columnar))
+            if telemetry is None:
+                missing.append(lap_id)
+            ret[lap_id] = telemetry
+
+        if missing:
+            def query():
+                data = self._query_laps_telemetry(session_id, missing, filter_channels, columnar)
+                for lap_id, lap_data in data.items():
+                    self.cache.put((session_id, 'telemetry', lap_id, channel_set, columnar), lap_data)
+                return data
+            telemetry = self.flights.do((session_id, 'telemetry', tuple(missing), channel_set, columnar), query)
+            ret.update(telemetry)
+
+        return ret
+
+    def _query_laps_telemetry(self, session_id, lap_ids, filter_channels, columnar):
+        channels = self._telemetry_projection(filter_channels)
+
+        if columnar:
+            ret = {lap_id: {name: list() for name in channels.keys()} for lap_id in lap_ids}
+        else:
+            ret = {lap_id: list() for lap_id in lap_ids}
+
+        if self.get_telemetry_layout(session_id) == 'columnar':
+            cursor = self._dbclient[session_id]['lap_telemetry'].find({'_id': {'$in': list(ret.keys())}}, channels)
+            for lap in cursor:
+                lap_id = lap.pop('_id')
+                if columnar:
+                    ret[lap_id].update(lap)
+                else:
+                    names = list(lap.keys())
+                    ret[lap_id] = [dict(zip(names, values)) for values in zip(*lap.values())]
+            return ret
+
+        channels['_id'] = 0
+        channels['LapId'] = 1
+        cursor = self._dbclient[session_id]['telemetry'].find({'LapId': {'$in': list(ret.keys())}}, channels)
+        for sample in cursor:
+            lap = ret[sample.pop('LapId')]
+            if columnar:
+                for name, values in lap.items():
+                    values.append(sample.get(name))
+            else:
+                lap.append(sample)
+
+        return ret
+
+    def warm_up(self, n_sessions, channels=()):
+        """Preload the timing data and the fastest laps of the most recent sessions into the cache.
+
+        For each session, the lap summary, the lap index (all timing data) and the fastest lap of each driver
+        are loaded. The telemetry data of the fastest laps is loaded once per channel in `channels`,
+        as it is requested by clients.
+
+        :param n_sessions: number of sessions, most recent first (by 'date')
+        :param channels: (optional) channel names
+        :type n_sessions: int
+        :type channels: list or tuple
+        :return: list of the ids of the preloaded sessions
+        """
+        self.check_revisions()
+        sessions = [session['id'] for session in
+                    self._sessions.find({}, {'_id': 0, 'id': 1}).sort('date', pymongo.DESCENDING).limit(n_sessions)]
+
+        for session_id in sessions:
+            summary = self.get_lap_summary(session_id)
+            index = self.get_lap_index(session_id)
+
+            if summary is not None:
+                fastest = [driver['fastest'] for driver in summary.values() if driver['fastest'] is not None]
+            else:
+                drivernumbers = sorted({lap['DriverNumber'] for lap in index.find(datetime.min, datetime.max)})
+                fastest = self.get_timing_data_multi(session_id, drivernumbers, lap='fastest')
+
+            lap_ids = [lap['_id'] for lap in fastest]
+            for channel in channels:
+                self.get_laps_telemetry(session_id, lap_ids, (channel, ))
+
+        return sessions
+
+    def get_archive(self, session_id):
+        """Return the :class:`archive.SessionArchive` of a session or None if the session is not archived.
+
+        Archives whose revision does not match the session's current revision are not used.
+        The result is cached per session until the session is invalidated.
+
+        :param session_id: the sessions unique id
+        :type session_id: str
+        """
+        if self._archive_dir is None:
+            return None
+
+        revision = self.get_session_revision(session_id)
+        # check_revisions and invalidate_session may replace or modify the dict concurrently; it is read only once
+        try:
+            return self._archives[session_id]
+        except KeyError:
+            pass
+
+        session_archive = None
+        directory = os.path.join(self._archive_dir, session_id)
+        if revision is not None and archive.exists(directory):
+            try:
+                session_archive = archive.SessionArchive(directory)
+            except ValueError:
+                session_archive = None  # older format version; used again after the session is exported again
+            if session_archive is not None and session_archive.revision != revision:
+                session_archive = None  # outdated; the session has been loaded again since it was exported
+        self._archives[session_id] = session_archive
+        return session_archive
+
+    def export_archive(self, session_id, directory=None, chunk_size=50):
+        """Export the timing data and telemetry data of a session to a file archive.
+
+        Afterwards, the session is read from the archive (if `directory` is this instance's `archive_dir`).
+        The session's data in the database is not modified.
+
+        :param session_id: the sessions unique id
+        :param directory: (optional) archive directory; default: `archive_dir`
+        :param chunk_size: (optional) number of laps which are read from the database per query
+        :type session_id: str
+        :type directory: str
+        :type chunk_size: int
+        :return: directory of the session's archive
+        """
+        directory = directory or self._archive_dir
+        if directory is None:
+            raise ValueError("No archive directory specified")
+
+        revision = self.get_session_revision(session_id)
+        if revision is None:
+            raise ValueError("Unknown session: {}".format(session_id))
+
+        database = self._dbclient[session_id]
+        timing = list(database['timingdata'].find().sort([('DriverNumber', 1), ('LapNumber', 1)]))
+
+        if self.get_telemetry_layout(session_id) == 'columnar':
+            sample = database['lap_telemetry'].find_one() or dict()
+        else:
+            sample = database['telemetry'].find_one() or dict()
+        channels = [name for name in sample.keys() if name not in ('_id', 'LapId', 'index', 'LapHash')]
+
+        def laps():
+            lap_ids = [lap['_id'] for lap in timing]
+            for i in range(0, len(lap_ids), chunk_size):
+                chunk = lap_ids[i:i + chunk_size]
+                telemetry = self._query_laps_telemetry(session_id, chunk, channels, columnar=True)
+                for lap_id in chunk:
+                    yield lap_id, telemetry[lap_id]
+
+        session_directory = os.path.join(directory, session_id)
+        archive.write_archive(session_directory, timing, laps(), channels, revision)
+        self._archives.pop(session_id, None)
+        return session_directory
+
+    def get_telemetry_layout(self, session_id):
+        """Return the storage layout which is used for the telemetry data of a session.
+
+        'rows': one document per telemetry sample in collection 'telemetry' (each document has a 'LapId')
+        'columnar': one document per lap in collection 'lap_telemetry' (one array per channel, '_id' is the lap id)
+
+        The result is cached per session until the session is invalidated.
+
+        :param session_id: the sessions unique id
+        :type session_id: str
+        :return: 'rows' or 'columnar'
+        """
+        if session_id not in self._telemetry_layouts:
+            names = self._dbclient[session_id].list_collection_names(filter={'name': 'lap_telemetry'})
+            self._telemetry_layouts[session_id] = 'columnar' if names else 'rows'
+        return self._telemetry_layouts[session_id]
+
+    def check_revisions(self):
+        """Discard cached data of all sessions which have been loaded again since they were cached.
+
+        The revisions of all sessions are requested from the database at most once per `revision_check_interval`.
+        The driver rosters (see :attr:`drivers`) are reloaded and new session archives are detected at the same time.
+        """
+        now = time.monotonic()
+        if self._revisions_checked is not None and now - self._revisions_checked < self._revision_check_interval:
+            return
+
+        with self._revision_lock:
+            if self._revisions_checked is not None and now - self._revisions_checked < self._revision_check_interval:
+                return  # checked by another thread in the meantime
+            self._revisions_checked = now
+
+            self.drivers.load(self._drivers)
+
+            # sessions which were not archived are looked up again; they may have been exported in the meantime
+            self._archives = {sid: value for sid, value in self._archives.items() if value is not None}
+
+            for session in self._sessions.find({}, {'_id': 0, 'id': 1, 'revision': 1}):
+                revision = session.get('revision', 0)
+                if session['id'] in self._revisions and self._revisions[session['id']] != revision:
+                    self.invalidate_session(session['id'])
+                self._revisions[session['id']] = revision
+
+            # stable across restarts, can therefore be used for building ETags
+            self.data_version = hashlib.sha1(repr(sorted(self._revisions.items())).encode('utf-8')).hexdigest()
+
+    def get_session_revision(self, session_id):
+        """Return the revision of a session or None if the session is unknown.
+
+        The revision is incremented each time a session is loaded into the database.
+
+        :param session_id: the sessions unique id
+        :type session_id: str
+        """
+        self.check_revisions()
+        return self._revisions.get(session_id)
+
+    def invalidate_session(self, session_id):
+        """Discard all cached data of a session.
+
+        :param session_id: the sessions unique id
+        :type session_id: str
+        """
+        self.cache.invalidate_session(session_id)
+        self._telemetry_layouts.pop(session_id, None)
+        self._archives.pop(session_id, None)
+
+    def ensure_indexes(self, session_id):
+        """Create all indexes which are required for efficient queries on a session's database.
+
+        See :attr:`SESSION_INDEXES`. Collections which are used by :meth:`get_time_range` get an index on 'time'.
+        Collections which do not exist are skipped. Existing indexes are not modified.
+
+        :param session_id: the sessions unique id
+        :type session_id: str
+        :return: list of the names of all indexes which are required (created or already existing)
+        """
+        database = self._dbclient[session_id]
+        names = list()
+
+        for collection_name in database.list_collection_names():
+            if collection_name in self.SESSION_INDEXES:
+                for keys in self.SESSION_INDEXES[collection_name]:
+                    names.append(database[collection_name].create_index(keys))
+            elif '-' in collection_name:  # '<carnumber>-<datatype>'
+                names.append(database[collection_name].create_index('time'))
+
+        return names
+
+    def explain_queries(self, session_id):
+        """Explain the query shapes which are used by this class and report collection scans.
+
+        The queries are run against a session's real data using values from a sample lap.
+
+        :param session_id: the sessions unique id
+        :type session_id: str
+        :return: list of dicts, one per query shape: {'query': description, 'collscan': bool}
+        """
+        database = self._dbclient[session_id]
+        ret = list()
+
+        sample = database['timingdata'].find_one({'LapStartDate': {'$type': 'date'}})
+        if sample is not None:
+            timerange = (sample['LapStartDate'], sample['LapStartDate'])
+            shapes = (('timing data, fastest lap', {'lap': 'fastest'}),
+                      ('timing data, by lap number', {'lap': [sample['LapNumber']]}),
+                      ('timing data, by time (starts and ends in)', {'timerange': timerange}),
+                      ('timing data, by time (starts in)', {'timerange': timerange, 'ends_in': False}),
+                      ('timing data, by time (ends in)', {'timerange': timerange, 'starts_in': False}))
+
+            for description, kwargs in shapes:
+                options = {'lap': (), 'timerange': (), 'starts_in': True, 'ends_in': True}
+                options.update(kwargs)
+                query = self._timing_query((sample['DriverNumber'], ), **options)
+                if options['lap'] == 'fastest':
+                    plan = database.command('explain', {'aggregate': 'timingdata',
+                                                        'pipeline': self._fastest_lap_pipeline(query),
+                                                        'cursor': {}},
+                                            verbosity='queryPlanner')
+                else:
+                    plan = database['timingdata'].find(query).explain()
+                ret.append({'query': description, 'collscan': _has_collscan(plan)})
+
+            if self.get_telemetry_layout(session_id) == 'rows':
+                plan = database['telemetry'].find({'LapId': {'$in': [sample['_id']]}}).explain()
+                ret.append({'query': 'lap telemetry (rows)', 'collscan': _has_collscan(plan)})
+            else:
+                plan = database['lap_telemetry'].find({'_id': {'$in': [sample['_id']]}}).explain()
+                ret.append({'query': 'lap telemetry (columnar)', 'collscan': _has_collscan(plan)})
+
+        for collection_name in database.list_collection_names():
+            if '-' in collection_name:
+                plan = database[collection_name].find({'time': {'$gte': 0, '$lt': 0}}).explain()
+                ret.append({'query': 'time range ({})'.format(collection_name), 'collscan': _has_collscan(plan)})
+
+        return ret
+
+    @staticmethod
+    def _telemetry_projection(filter_channels):
+        channels = {'SessionTime': 1}
         if filter_channels:
             for name in filter_channels:
                 channels[name] = 1
-
-        telemetry = list(self._dbclient[session_id]['telemetry'].find({'LapId': lap_id}, channels))
-        return telemetry
+        return channels
 
     def insert_many(self, db_name, collection_name, data):
         """Insert multiple documents into a collection.
@@ -196,3 +950,37 @@ class DataProvider:
         :type data: list or tuple or pandas.DataFrame
         """
         self._dbclient[db_name][collection_name].insert_many(data)
+
+
+def _session_season(session_id):
+    """Return the season (year) of a session id 'YYYY-NN-M' or None."""
+    try:
+        return int(session_id.split('-')[0])
+    except ValueError:
+        return None
+
+
+def _session_time_window(lap, telemetry, start, end):
+    """Convert a time range (datetimes) to session time in seconds, using a lap's start date as reference.
+
+    :return: tuple (start, end) in seconds
+    """
+    if isinstance(lap.get('Time'), (int, float)) and isinstance(lap.get('LapTime'), (int, float)):
+        lap_start = lap['Time'] - lap['LapTime']  # 'Time' is the session time at the end of the lap
+    else:
+        times = telemetry.get('SessionTime') if isinstance(telemetry, dict) else \
+            [sample.get('SessionTime') for sample in telemetry[:1]]
+        lap_start = times[0] if len(times) else 0.0
+    return (lap_start + (start - lap['LapStartDate']).total_seconds(),
+            lap_start + (end - lap['LapStartDate']).total_seconds())
+
+
+def _has_collscan(plan):
+    """Return True if the winning plan of an explain() output contains a collection scan stage."""
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'COLLSCAN':
+            return True
+        return any(_has_collscan(value) for key, value in plan.items() if key != 'rejectedPlans')
+    if isinstance(plan, list):
+        return any(_has_collscan(value) for value in plan)
+    return False
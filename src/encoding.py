@@ -0,0 +1,122 @@
+"""
+:mod:`encoding` - Binary Response Format
+========================================
+
+This module encodes telemetry data into a compact binary format.
+
+The format consists of a short stream header followed by one frame per driver and lap.
+
+Stream header (8 bytes):
+    - magic bytes ``F1TC``
+    - format version as uint32
+
+Frame:
+    - length of the frame header in bytes as uint32
+    - frame header; UTF-8 encoded JSON object::
+
+        {"driver": "HAM", "laptime": 85.645, "lapnumber": 15, "length": 712,
+         "channels": [["SessionTime", "f8"], ["Speed", "f4"]]}
+
+    - one packed array of ``length`` values per channel, in the order of ``channels``;
+      ``f8`` is float64, ``f4`` is float32
+
+All numbers are little-endian. Missing values are encoded as NaN.
+"""
+
+import json
+import struct
+import sys
+from array import array
+
+
+MIMETYPE = 'application/vnd.f1analysis.columnar'
+
+VERSION = 1
+
+STREAM_HEADER = b'F1TC' + struct.pack('<I', VERSION)
+
+# channels which need more precision than float32 provides
+FLOAT64_CHANNELS = ('SessionTime', 'Time')
+
+# channels with non-numeric values; they can not be encoded
+NON_NUMERIC_CHANNELS = ('Date', 'Status', 'Source')
+
+
+def check_channels(channels):
+    """Raise a ValueError if one of the channels can not be encoded.
+
+    Streamed responses need to be checked before they are started; an error while encoding a lap would only
+    truncate the body.
+
+    :param channels: channel names
+    :type channels: list or tuple
+    """
+    invalid = [name for name in channels if name in NON_NUMERIC_CHANNELS]
+    if invalid:
+        raise ValueError("Channels can not be encoded in the binary format: {}".format(', '.join(invalid)))
+
+
+def encode_telemetry(data):
+    """Encode the result of :meth:`dataprovider.DataProvider.get_telemetry_data` (columnar) as bytes.
+
+    :param data: list of lap objects; the telemetry of each lap needs to be a dict of channel arrays
+    :type data: list
+    :rtype: bytes
+    """
+    return b''.join(iter_encode_telemetry(data))
+
+
+def iter_encode_telemetry(data):
+    """Encode lap objects one at a time, for streaming responses.
+
+    Yields the stream header first and then one frame per lap.
+
+    :param data: iterable of lap objects; the telemetry of each lap needs to be a dict of channel arrays
+    """
+    yield STREAM_HEADER
+    for lap in data:
+        yield encode_lap(lap)
+
+
+def encode_lap(lap):
+    """Encode one lap object as a single frame.
+
+    :param lap: lap object with keys 'driver', 'laptime', 'lapnumber' and 'telemetry' (dict of channel arrays)
+    :type lap: dict
+    :rtype: bytes
+    """
+    telemetry = lap['telemetry']
+    length = len(telemetry.get('SessionTime', ()))
+
+    channels = list()
+    columns = list()
+    for name, values in telemetry.items():
+        typecode = 'd' if name in FLOAT64_CHANNELS else 'f'
+        channels.append([name, 'f8' if typecode == 'd' else 'f4'])
+        columns.append(_pack(typecode, values, length, name))
+
+    header = json.dumps({'driver': lap['driver'], 'laptime': lap['laptime'], 'lapnumber': lap['lapnumber'],
+                         'length': length, 'channels': channels}).encode('utf-8')
+
+    return b''.join([struct.pack('<I', len(header)), header] + columns)
+
+
+def _pack(typecode, values, length, name):
+    if len(values) != length:
+        if len(values):
+            raise ValueError("Length of channel '{}' does not match length of 'SessionTime'".format(name))
+        values = (None, ) * length  # channel is not available for this lap
+
+    if hasattr(values, 'dtype'):  # NumPy array (archived sessions); converted without a Python loop
+        if values.dtype.kind not in 'biuf':
+            raise ValueError("Channel '{}' contains non-numeric values".format(name))
+        return values.astype('<f8' if typecode == 'd' else '<f4').tobytes()
+
+    try:
+        packed = array(typecode, [float('nan') if val is None else val for val in values])
+    except TypeError:
+        raise ValueError("Channel '{}' contains non-numeric values".format(name))
+
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
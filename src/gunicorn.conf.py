@@ -0,0 +1,32 @@
+"""gunicorn configuration for running the server with multiple worker processes.
+
+Usage (from this directory)::
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is created once in the master process and then forked. Each worker creates its own database client
+and preloads the most recent sessions before it accepts requests (see :func:`app.init_worker`).
+/metrics reports the metrics of all workers; they are shared through the directory ``METRICS_DIR``
+(see :func:`app.init_shared_metrics`).
+Set ``WARM_UP_SESSIONS`` and other options in a configuration file given by the environment variable
+``F1ANALYSIS_SETTINGS``.
+"""
+
+import multiprocessing
+
+
+bind = '127.0.0.1:5000'
+workers = multiprocessing.cpu_count()
+worker_class = 'gthread'  # requests mostly wait for the database
+threads = 4
+preload_app = True
+
+
+def on_starting(server):
+    import app
+    app.init_shared_metrics(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    import app
+    app.init_worker(worker.wsgi)
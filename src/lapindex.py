@@ -0,0 +1,96 @@
+"""
+:mod:`lapindex` - Interval Index over Lap Dates
+===============================================
+
+In-memory index which answers "which laps start in / end in / overlap a time range" for all drivers of a session
+with a binary search instead of a database query.
+"""
+
+import sys
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from cache import estimate_size
+
+
+class LapIntervalIndex:
+    def __init__(self, laps):
+        """Interval index over the start and end dates of all laps of a session.
+
+        Laps are sorted once by start date and once by end date. A lookup is a binary search on one of them,
+        followed by a scan over the matching laps only.
+        Laps without a start date ('inf' placeholder) are not indexed. Laps without an end date are only found
+        by their start date; for overlap queries they last until the driver's next lap starts, the last of them
+        is open-ended.
+
+        :param laps: timing data; list of dicts with the keys 'DriverNumber', 'LapStartDate' and 'LapEndDate'
+        :type laps: list
+        """
+        self._by_start = sorted((lap for lap in laps if isinstance(lap.get('LapStartDate'), datetime)),
+                                key=lambda lap: lap['LapStartDate'])
+        self._starts = [lap['LapStartDate'] for lap in self._by_start]
+
+        self._by_end = sorted((lap for lap in self._by_start if isinstance(lap.get('LapEndDate'), datetime)),
+                              key=lambda lap: lap['LapEndDate'])
+        self._ends = [lap['LapEndDate'] for lap in self._by_end]
+
+        # end date of each lap in _by_start for overlap queries; None: open-ended
+        self._until = [lap['LapEndDate'] if isinstance(lap.get('LapEndDate'), datetime) else None
+                       for lap in self._by_start]
+        next_start = dict()  # driver number -> start date of the driver's next lap
+        for i in reversed(range(len(self._by_start))):
+            lap = self._by_start[i]
+            if self._until[i] is None:
+                self._until[i] = next_start.get(lap['DriverNumber'])
+            next_start[lap['DriverNumber']] = lap['LapStartDate']
+        self._open = [i for i, until in enumerate(self._until) if until is None]
+
+        # overlapping laps which are not open-ended start at most this long before the range starts
+        self.max_duration = max((until - start for start, until in zip(self._starts, self._until) if until is not None),
+                                default=timedelta(0))
+
+    def __len__(self):
+        return len(self._by_start)
+
+    def __sizeof__(self):
+        # the laps are shared by all lists, they are counted once (see cache.estimate_size)
+        return object.__sizeof__(self) + estimate_size(self._by_start) + \
+            sum(sys.getsizeof(items) for items in (self._starts, self._by_end, self._ends, self._until, self._open))
+
+    def find(self, start, end, starts_in=True, ends_in=True, drivernumbers=None):
+        """Return all laps within a time range (including the boundaries).
+
+        :param start: range start
+        :param end: range end
+        :param starts_in: (optional) the lap needs to start in the time range
+        :param ends_in: (optional) the lap needs to end in the time range
+        :param drivernumbers: (optional) only return laps of these drivers; default: all drivers
+
+        If `starts_in` and `ends_in` are both False, all laps which overlap the time range are returned.
+        A lap without an end date needs to start in the time range if `starts_in` is True, it is never returned
+        if `ends_in` is True.
+
+        :type start: datetime
+        :type end: datetime
+        :type starts_in: bool
+        :type ends_in: bool
+        :type drivernumbers: list or tuple
+        :return: list of laps ordered by start date (by end date if only `ends_in` is True); the laps are shared
+          with the index and must not be modified
+        """
+        if ends_in and not starts_in:
+            laps = self._by_end[bisect_left(self._ends, start):bisect_right(self._ends, end)]
+        elif starts_in:
+            laps = self._by_start[bisect_left(self._starts, start):bisect_right(self._starts, end)]
+            if ends_in:
+                laps = [lap for lap in laps if isinstance(lap['LapEndDate'], datetime) and lap['LapEndDate'] <= end]
+        else:
+            earliest = start - self.max_duration if start - datetime.min > self.max_duration else datetime.min
+            lower = bisect_left(self._starts, earliest)
+            positions = [i for i in self._open if i < lower] + list(range(lower, bisect_right(self._starts, end)))
+            laps = [self._by_start[i] for i in positions if self._until[i] is None or self._until[i] >= start]
+
+        if drivernumbers is not None:
+            numbers = set(drivernumbers)
+            laps = [lap for lap in laps if lap['DriverNumber'] in numbers]
+        return laps
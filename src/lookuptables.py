@@ -1,6 +1,18 @@
-import pandas as pd
-''
+"""
+:mod:`lookuptables` - Drivers and Channels
+==========================================
 
+Lookup tables for drivers and telemetry channels.
+
+Drivers are managed by a :class:`DriverRegistry` which holds one roster per season.
+All lookups are simple dict lookups.
+"""
+
+import hashlib
+import threading
+
+
+# default roster; used for seasons which are not available from the database
 drivers = [['44', 'HAM', 'Mercedes'], ['77', 'BOT', 'Mercedes'],
            ['5', 'VET', 'Ferrari'], ['16', 'LEC', 'Ferrari'],
            ['33', 'VER', 'Red Bull'], ['23', 'ALB', 'Red Bull'],
@@ -13,22 +25,97 @@ drivers = [['44', 'HAM', 'Mercedes'], ['77', 'BOT', 'Mercedes'],
            ['6', 'LAT', 'Williams'], ['63', 'RUS', 'Williams'],
            ['88', 'KUB', 'Alfa Romeo']]
 
-drivers_pd = pd.DataFrame(drivers, columns=('Number', 'Abb', 'Team'))
+DRIVER_FIELDS = ('Number', 'Abb', 'Team')
+
+
+class DriverRegistry:
+    def __init__(self, default_roster=drivers):
+        """Registry of drivers with one roster per season.
+
+        For each season, a dict index is precomputed for every field (Number, Abb, Team).
+        Seasons which are unknown use the default roster.
+
+        Rosters can be (re-)loaded from the database at any time using :meth:`load`.
+
+        :param default_roster: list of drivers [[number, abbreviation, team], ...]
+        """
+        self._default = _build_index(default_roster)
+        self._seasons = dict()  # season -> index
+        self._lock = threading.Lock()
+        self.version = _roster_hash({None: default_roster})  # changes whenever the rosters change
+
+    def load(self, collection):
+        """Load per-season rosters from the database (collection 'F1Info.Drivers').
+
+        Documents need to have the fields `season`, `number`, `abb` and `team`.
+        All previously loaded rosters are replaced.
+
+        :param collection: pymongo collection
+        """
+        rosters = dict()
+        for doc in collection.find({}, {'_id': 0, 'season': 1, 'number': 1, 'abb': 1, 'team': 1}):
+            rosters.setdefault(doc['season'], list()).append([str(doc['number']), doc['abb'], doc.get('team')])
+
+        version = _roster_hash(rosters)
+        if version == self.version:
+            return
+
+        seasons = {season: _build_index(roster) for season, roster in rosters.items()}
+        with self._lock:
+            self._seasons = seasons  # replacing the whole dict is safe for concurrent readers
+            self.version = version
+
+    def lookup(self, by='', value='', get='', season=None):
+        """Return the value of field `get` for the driver(s) whose field `by` equals `value`.
+
+        Example: ``lookup(by='Abb', value='HAM', get='Number')`` returns '44'
+
+        :param by: field to search; one of 'Number', 'Abb', 'Team'
+        :param value: value to search for
+        :param get: field to return; one of 'Number', 'Abb', 'Team'
+        :param season: (optional) season year
+        :return: a single value; a list of values if multiple drivers match (e.g. by 'Team')
+        """
+        try:
+            matches = self._get_index(season)[by][value]
+        except KeyError:
+            raise ValueError("Unknown driver: {} = {}".format(by, value))
+
+        if len(matches) == 1:
+            return matches[0][get]
+        return [driver[get] for driver in matches]
+
+    def get_abbs(self, season=None):
+        """Return a list of the abbreviations of all drivers of a season."""
+        return list(self._get_index(season)['Abb'].keys())
+
+    def _get_index(self, season):
+        return self._seasons.get(season, self._default)
+
+
+def _roster_hash(rosters):
+    return hashlib.sha1(repr(sorted(rosters.items(), key=repr)).encode('utf-8')).hexdigest()
+
+
+def _build_index(roster):
+    index = {field: dict() for field in DRIVER_FIELDS}
+    for values in roster:
+        driver = dict(zip(DRIVER_FIELDS, values))
+        for field in DRIVER_FIELDS:
+            index[field].setdefault(driver[field], list()).append(driver)
+    return index
+
+
+registry = DriverRegistry()
 
 
 def driver_query(by='', value='', get=''):
-    result = drivers_pd.query('{} =="{}"'.format(by, value))[get]
-    if len(result) == 1:
-        return result.values[0]
-    else:
-        return result
+    """Lookup using the default roster; see :meth:`DriverRegistry.lookup`"""
+    return registry.lookup(by=by, value=value, get=get)
 
 
 def get_driver_abbs():
-    data = list()
-    for drv in drivers:
-        data.append(drv[1])
-    return data
+    return registry.get_abbs()
 
 
 channel_names = {'0': 'RPM', '2': 'Speed', '3': 'nGear', '4': 'Throttle', '5': 'Brake', '45': 'DRS'}
@@ -0,0 +1,387 @@
+"""
+:mod:`metrics` - Performance Instrumentation
+============================================
+
+This module collects performance metrics for each request:
+
+- number of database queries, time spent in the database and number of documents returned
+- serialization time
+- response size
+
+The metrics of a request are sent to the client as ``Server-Timing`` header. They are also
+aggregated per endpoint and `selectBy` mode and exported in the Prometheus text format.
+
+Database queries are counted by a pymongo command listener. The metrics object of the current request is
+stored in a context variable, so that queries which run in worker threads (see
+:class:`dataprovider.DataProvider`) are counted as well, if the context is passed on to the thread.
+
+Metrics are collected per process. If the server runs multiple worker processes, they are shared through a
+directory (see :func:`share`), so that each scrape returns the metrics of all workers.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+
+# histogram buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# minimum time between two writes of a process's shared metrics in seconds (see SharedMetrics)
+SHARE_INTERVAL = 1.0
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self, endpoint):
+        """Metrics of a single request.
+
+        :param endpoint: endpoint name (url rule) used as label
+        """
+        self.endpoint = endpoint
+        self.select_by = ''
+        self.start = time.perf_counter()
+        self.duration = 0.0
+
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.db_docs = 0
+        self.serialization_time = 0.0
+        self.response_bytes = 0
+
+        self._lock = threading.Lock()  # queries may be counted from multiple threads
+
+    def add_query(self, duration, docs):
+        with self._lock:
+            self.db_queries += 1
+            self.db_time += duration
+            self.db_docs += docs
+
+    def server_timing(self):
+        """Return the value for a Server-Timing header (durations in milliseconds)"""
+        return 'db;dur={:.2f};desc="{} queries, {} docs", ser;dur={:.2f}, total;dur={:.2f}'.format(
+            self.db_time * 1000, self.db_queries, self.db_docs, self.serialization_time * 1000,
+            (time.perf_counter() - self.start) * 1000)
+
+
+def start_request(endpoint):
+    """Start collecting metrics for a new request in the current context.
+
+    :return: :class:`RequestMetrics`
+    """
+    request_metrics = RequestMetrics(endpoint)
+    _current.set(request_metrics)
+    return request_metrics
+
+
+def current():
+    """Return the :class:`RequestMetrics` of the current request or None"""
+    return _current.get()
+
+
+def clear():
+    """Detach the request metrics from the current context"""
+    _current.set(None)
+
+
+def finish_request(request_metrics):
+    """Record the metrics of a finished request in the :data:`registry`"""
+    request_metrics.duration = time.perf_counter() - request_metrics.start
+    registry.observe(request_metrics)
+    if _shared is not None:
+        _shared.update()
+
+
+@contextmanager
+def measure_serialization():
+    """Context manager which adds the time spent inside it to the current request's serialization time"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_metrics = _current.get()
+        if request_metrics is not None:
+            request_metrics.serialization_time += time.perf_counter() - start
+
+
+def instrument_stream(chunks, request_metrics):
+    """Wrap the body of a streamed response.
+
+    The body is generated after the view function has returned. Database queries which are made while a chunk
+    is generated are still counted for the request. Time which is spent generating chunks outside of the
+    database is counted as serialization time. The request is recorded when the stream is finished.
+    """
+    iterator = iter(chunks)
+    try:
+        while True:
+            token = _current.set(request_metrics)
+            start = time.perf_counter()
+            db_time = request_metrics.db_time
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                _current.reset(token)
+                request_metrics.serialization_time += \
+                    time.perf_counter() - start - (request_metrics.db_time - db_time)
+
+            request_metrics.response_bytes += len(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            yield chunk
+    finally:
+        finish_request(request_metrics)
+
+
+class CommandListener(monitoring.CommandListener):
+    """Counts database queries for the current request; pass to pymongo.MongoClient(event_listeners=[...])"""
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        request_metrics = _current.get()
+        if request_metrics is not None:
+            request_metrics.add_query(event.duration_micros / 1e6, _count_documents(event.reply))
+
+    def failed(self, event):
+        request_metrics = _current.get()
+        if request_metrics is not None:
+            request_metrics.add_query(event.duration_micros / 1e6, 0)
+
+
+def _count_documents(reply):
+    cursor = reply.get('cursor')
+    if cursor is None:
+        return 0
+    return len(cursor.get('firstBatch', cursor.get('nextBatch', ())))
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    HISTOGRAMS = (('f1_request_duration_seconds', 'Request duration', 'duration'),
+                  ('f1_db_duration_seconds', 'Time spent in database queries per request', 'db_time'),
+                  ('f1_serialization_duration_seconds', 'Serialization time per request', 'serialization_time'))
+
+    COUNTERS = (('f1_db_queries_total', 'Number of database queries', 'db_queries'),
+                ('f1_db_documents_total', 'Number of documents returned by the database', 'db_docs'),
+                ('f1_response_bytes_total', 'Number of response body bytes', 'response_bytes'))
+
+    def __init__(self):
+        """Aggregated metrics of all requests, by endpoint and selectBy mode"""
+        self.clear()
+
+    def clear(self):
+        """Remove all metrics"""
+        self._histograms = {name: dict() for name, _, _ in self.HISTOGRAMS}
+        self._counters = {name: dict() for name, _, _ in self.COUNTERS}
+        self._lock = threading.Lock()
+
+    def observe(self, request_metrics):
+        labels = (request_metrics.endpoint, request_metrics.select_by)
+        with self._lock:
+            for name, _, attribute in self.HISTOGRAMS:
+                histogram = self._histograms[name].setdefault(labels, Histogram())
+                histogram.observe(getattr(request_metrics, attribute))
+            for name, _, attribute in self.COUNTERS:
+                self._counters[name][labels] = self._counters[name].get(labels, 0) + getattr(request_metrics,
+                                                                                             attribute)
+
+    def snapshot(self):
+        """Return all histograms and counters as a JSON serializable dict (see :meth:`merge`)"""
+        with self._lock:
+            return {'histograms': {name: [[list(labels), histogram.counts, histogram.sum, histogram.count]
+                                          for labels, histogram in values.items()]
+                                   for name, values in self._histograms.items()},
+                    'counters': {name: [[list(labels), value] for labels, value in values.items()]
+                                 for name, values in self._counters.items()}}
+
+    def merge(self, snapshot):
+        """Add the histograms and counters of a snapshot (see :meth:`snapshot`) to this registry"""
+        with self._lock:
+            for name, entries in snapshot['histograms'].items():
+                for labels, counts, total, count in entries:
+                    histogram = self._histograms[name].setdefault(tuple(labels), Histogram())
+                    histogram.counts = [current + added for current, added in zip(histogram.counts, counts)]
+                    histogram.sum += total
+                    histogram.count += count
+            for name, entries in snapshot['counters'].items():
+                for labels, value in entries:
+                    labels = tuple(labels)
+                    self._counters[name][labels] = self._counters[name].get(labels, 0) + value
+
+    def render(self, gauges=()):
+        """Return all metrics in the Prometheus text format.
+
+        :param gauges: (optional) additional metrics; list of tuples (name, help, value)
+        :rtype: str
+        """
+        lines = list()
+        with self._lock:
+            for name, description, _ in self.HISTOGRAMS:
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} histogram'.format(name))
+                for labels, histogram in sorted(self._histograms[name].items()):
+                    label_str = _format_labels(labels)
+                    for bound, count in zip(BUCKETS, histogram.counts):
+                        lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, label_str, bound, count))
+                    lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, label_str, histogram.count))
+                    lines.append('{}_sum{{{}}} {}'.format(name, label_str, histogram.sum))
+                    lines.append('{}_count{{{}}} {}'.format(name, label_str, histogram.count))
+
+            for name, description, _ in self.COUNTERS:
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} counter'.format(name))
+                for labels, value in sorted(self._counters[name].items()):
+                    lines.append('{}{{{}}} {}'.format(name, _format_labels(labels), value))
+
+        for name, description, value in gauges:
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} gauge'.format(name))
+            lines.append('{} {}'.format(name, value))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    endpoint, select_by = labels
+    return 'endpoint="{}",select_by="{}"'.format(endpoint.replace('"', '\\"'), select_by.replace('"', '\\"'))
+
+
+class SharedMetrics:
+    def __init__(self, directory, local_registry, gauges=None, interval=SHARE_INTERVAL):
+        """Metrics of multiple processes, shared through a directory.
+
+        Each process writes its registry and its gauges to its own file in `directory`, at most once per `interval`
+        after a request and whenever the metrics are rendered. Rendering merges the files of all processes.
+        Histograms and counters include processes which have exited (e.g. restarted workers), so that they never
+        decrease. Gauges are summed over running processes.
+
+        :param directory: directory which is shared by all processes
+        :param local_registry: the registry of the calling process
+        :param gauges: (optional) callable which returns the gauges of the calling process; list of tuples
+          (name, help, value)
+        :param interval: (optional) minimum time between two writes in seconds
+        :type directory: str
+        :type local_registry: MetricsRegistry
+        :type interval: float
+        """
+        self.directory = directory
+        self.registry = local_registry
+        self.gauges = gauges
+        self.interval = interval
+        self._written = None  # (pid, time of the last write)
+        self._lock = threading.Lock()
+
+    def update(self, force=False):
+        """Write the metrics of the calling process to its file; at most once per `interval` unless `force` is set."""
+        pid = os.getpid()
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._written is not None and self._written[0] == pid \
+                    and now - self._written[1] < self.interval:
+                return
+            self._written = (pid, now)
+
+            data = self.registry.snapshot()
+            data['pid'] = pid
+            data['gauges'] = list(self.gauges()) if self.gauges is not None else list()
+
+            path = os.path.join(self.directory, 'metrics-{}.json'.format(pid))
+            with open(path + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(path + '.tmp', path)  # readers never see a partially written file
+
+    def render(self):
+        """Return the metrics of all processes in the Prometheus text format"""
+        self.update(force=True)
+
+        merged = MetricsRegistry()
+        gauges = dict()  # name -> [help, value]
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith('metrics-') and name.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    data = json.load(f)
+            except OSError:
+                continue  # removed concurrently
+
+            merged.merge(data)
+            if _is_running(data['pid']):
+                for gauge_name, description, value in data['gauges']:
+                    gauges.setdefault(gauge_name, [description, 0])[1] += value
+
+        return merged.render([(name, description, value) for name, (description, value) in gauges.items()])
+
+    @staticmethod
+    def reset(directory):
+        """Create `directory` if necessary and remove the metrics files of a previous run"""
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.startswith('metrics-'):
+                os.remove(os.path.join(directory, name))
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, but belongs to another user
+    return True
+
+
+def share(directory, gauges=None):
+    """Share the metrics of all processes which are forked from the calling process through a directory.
+
+    Call this once in the parent process (e.g. the master process of a pre-fork server) before the worker
+    processes are started. Metrics files of a previous run are removed. Afterwards, :func:`render` returns the
+    metrics of all processes.
+
+    :param directory: directory for the metrics files
+    :param gauges: (optional) callable which returns the gauges of the calling process (see :class:`SharedMetrics`)
+    :type directory: str
+    """
+    global _shared
+    SharedMetrics.reset(directory)
+    if _shared is None:
+        # a forked process starts without the parent's metrics; they are already in the parent's file
+        os.register_at_fork(after_in_child=registry.clear)
+    _shared = SharedMetrics(directory, registry, gauges)
+
+
+def render(gauges=()):
+    """Return the metrics in the Prometheus text format.
+
+    :param gauges: (optional) gauges of this process; list of tuples (name, help, value). If metrics are shared
+      (see :func:`share`), the gauges of all processes are taken from the callable which was passed to :func:`share`
+      instead.
+    :rtype: str
+    """
+    if _shared is not None:
+        return _shared.render()
+    return registry.render(gauges)
+
+
+command_listener = CommandListener()
+registry = MetricsRegistry()
+_shared = None  # SharedMetrics if metrics are shared between processes
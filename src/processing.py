@@ -0,0 +1,187 @@
+"""
+:mod:`processing` - Telemetry Processing
+========================================
+
+This module provides vectorized (NumPy) processing of telemetry data before it is sent to the client.
+
+Telemetry data of one lap is either a list of samples ``[{'SessionTime': ..., 'Speed': ...}, ...]``
+or a dict of channel arrays ``{'SessionTime': [...], 'Speed': [...]}``. All functions accept both.
+"""
+
+import numpy as np
+
+
+# axes for aligning laps (see align)
+AXES = ('time', 'distance')
+
+# channels with discrete values; these are resampled using the previous sample instead of linear interpolation
+DISCRETE_CHANNELS = ('nGear', 'DRS', 'Brake')
+
+
+def downsample(telemetry, max_points):
+    """Reduce the number of samples of one lap to at most `max_points` while preserving its shape.
+
+    Min/max bucketing is used: the samples are split into equally sized buckets and the minimum and maximum
+    of each bucket are kept. This keeps peaks (e.g. braking points) which a plot of the data would show.
+    If multiple channels are present, the buckets are split between them. The first and the last sample
+    are always kept. If `max_points` is too small for one bucket per channel, evenly spaced samples are kept instead.
+
+    :param telemetry: telemetry data of one lap (list of samples or dict of channel arrays)
+    :param max_points: maximum number of samples
+    :type max_points: int
+    :return: telemetry data in the same format as `telemetry`
+    """
+    if max_points < 2:
+        raise ValueError("Invalid value for 'maxPoints': {}".format(max_points))
+
+    columnar = isinstance(telemetry, dict)
+    length = len(telemetry.get('SessionTime', ())) if columnar else len(telemetry)
+    if length <= max_points:
+        return telemetry
+
+    if columnar:
+        channels = [values for name, values in telemetry.items() if name != 'SessionTime' and len(values)]
+    else:
+        names = [name for name in telemetry[0].keys() if name != 'SessionTime']
+        channels = [[sample.get(name) for sample in telemetry] for name in names]
+
+    # two samples per bucket, first and last sample are added separately
+    n_buckets = (max_points - 2) // (2 * len(channels)) if channels else 0
+    if n_buckets < 1:
+        indices = np.unique(np.linspace(0, length - 1, max_points).round().astype(int))
+    else:
+        indices = [np.array((0, length - 1))]
+        for values in channels:
+            indices.append(_min_max_indices(np.array(values, dtype=float), n_buckets))
+        indices = np.unique(np.concatenate(indices))
+
+    if columnar:
+        return {name: _take(values, indices) if len(values) else values for name, values in telemetry.items()}
+    return [telemetry[i] for i in indices]
+
+
+def clip(telemetry, start, end):
+    """Return only the samples of one lap with start <= SessionTime <= end.
+
+    Samples are expected to be ordered by SessionTime.
+
+    :param telemetry: telemetry data of one lap (list of samples or dict of channel arrays)
+    :param start: start of the time range (session time in seconds)
+    :param end: end of the time range (session time in seconds)
+    :type start: float
+    :type end: float
+    :return: telemetry data in the same format as `telemetry`
+    """
+    columnar = isinstance(telemetry, dict)
+    if columnar:
+        times = telemetry.get('SessionTime', ())
+    else:
+        times = [sample.get('SessionTime') for sample in telemetry]
+    times = _to_array(times)
+
+    indices = np.flatnonzero((times >= start) & (times <= end))
+    first, last = (int(indices[0]), int(indices[-1]) + 1) if len(indices) else (0, 0)
+
+    if columnar:
+        return {name: values[first:last] if len(values) else values for name, values in telemetry.items()}
+    return telemetry[first:last]
+
+
+def align(laps, channels, points, axis='time'):
+    """Resample multiple laps onto one common grid, so that they can be compared sample by sample.
+
+    The grid has `points` equally spaced values from 0 to the largest extent of all laps along `axis`:
+
+    - 'time': time since the first sample of the lap in seconds
+    - 'distance': distance since the first sample of the lap in meters; it is integrated from 'Speed' (km/h)
+
+    Continuous channels are interpolated linearly, channels in :data:`DISCRETE_CHANNELS` use the value of the
+    previous sample. Grid values beyond the end of a lap and channels which are not available are None.
+
+    :param laps: telemetry data of each lap (dict of channel arrays, including 'SessionTime';
+      'Speed' is required for the distance axis)
+    :param channels: names of the channels which are resampled
+    :param points: number of grid values
+    :param axis: (optional) 'time' or 'distance'
+    :type laps: list
+    :type channels: list
+    :type points: int
+    :type axis: str
+    :return: tuple (grid, resampled laps); the grid is a list of floats, each lap is a dict channel name -> list
+    """
+    if axis not in AXES:
+        raise ValueError("Invalid value for 'axis': {}".format(axis))
+    if points < 2:
+        raise ValueError("Invalid number of grid points: {}".format(points))
+
+    positions = [_lap_positions(telemetry, axis) for telemetry in laps]
+    extent = max((float(np.nanmax(x)) for x in positions if not np.isnan(x).all()), default=0.0)
+    grid = np.linspace(0.0, extent, points)
+
+    ret = list()
+    for telemetry, x in zip(laps, positions):
+        lap = dict()
+        for name in channels:
+            values = _to_array(telemetry.get(name) or ())
+            valid = ~(np.isnan(values) | np.isnan(x)) if len(values) == len(x) else np.zeros(0, dtype=bool)
+            if valid.sum() < 2:
+                lap[name] = [None] * points
+                continue
+
+            if name in DISCRETE_CHANNELS:
+                indices = np.searchsorted(x[valid], grid, side='right') - 1
+                resampled = np.where((indices >= 0) & (grid <= x[valid][-1]),
+                                     values[valid][np.maximum(indices, 0)], np.nan)
+            else:
+                resampled = np.interp(grid, x[valid], values[valid], left=np.nan, right=np.nan)
+            lap[name] = _to_list(resampled.round(3))
+        ret.append(lap)
+
+    return grid.round(3).tolist(), ret
+
+
+def _lap_positions(telemetry, axis):
+    """Return the position of each sample of a lap along the axis (starting at 0)"""
+    times = _to_array(telemetry.get('SessionTime') or ())
+    if not len(times):
+        return times
+    times = times - times[0]
+    if axis == 'time':
+        return times
+
+    speed = np.nan_to_num(_to_array(telemetry.get('Speed') or ())) / 3.6  # m/s
+    if len(speed) != len(times):
+        raise ValueError("Channel 'Speed' is required for aligning laps by distance")
+    return np.concatenate(([0.0], np.cumsum((speed[1:] + speed[:-1]) / 2 * np.diff(times))))
+
+
+def _to_array(values):
+    if isinstance(values, np.ndarray):
+        return values.astype(float)
+    return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+
+def _take(values, indices):
+    """Select samples of a channel; arrays stay arrays, lists stay lists"""
+    if isinstance(values, np.ndarray):
+        return values[indices]
+    return [values[i] for i in indices]
+
+
+def _to_list(values):
+    return [None if value != value else value for value in values.tolist()]  # NaN -> None
+
+
+def _min_max_indices(values, n_buckets):
+    """Return the indices of the minimum and maximum value of each bucket; NaN values are ignored."""
+    length = len(values)
+    bucket_size = -(-length // n_buckets)  # ceil
+
+    padded = np.pad(values, (0, n_buckets * bucket_size - length), mode='edge').reshape(n_buckets, bucket_size)
+    nan = np.isnan(padded)
+    offsets = np.arange(n_buckets) * bucket_size
+
+    idx_min = offsets + np.argmin(np.where(nan, np.inf, padded), axis=1)
+    idx_max = offsets + np.argmax(np.where(nan, -np.inf, padded), axis=1)
+
+    return np.minimum(np.concatenate((idx_min, idx_max)), length - 1)
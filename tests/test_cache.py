@@ -0,0 +1,88 @@
+"""Tests for :mod:`cache`."""
+
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from cache import LRUCache, SingleFlight, estimate_size  # noqa: E402
+
+
+def test_lru_eviction():
+    value = list(range(100))
+    cache = LRUCache(estimate_size(value) * 2)
+    cache.put(('a', 1), value)
+    cache.put(('a', 2), value)
+    assert cache.get(('a', 1)) is value  # ('a', 2) is now the least recently used entry
+
+    cache.put(('b', 1), value)
+    assert cache.get(('a', 2)) is None
+    assert cache.get(('a', 1)) is value and cache.get(('b', 1)) is value
+    assert cache.evictions == 1
+    assert cache.size <= cache.max_bytes
+
+
+def test_lru_invalidate_session():
+    cache = LRUCache(1024 ** 2)
+    cache.put(('a', 1), [1])
+    cache.put(('a', 2), [2])
+    cache.put(('b', 1), [3])
+
+    cache.invalidate_session('a')
+    assert cache.get(('a', 1)) is None and cache.get(('a', 2)) is None
+    assert cache.get(('b', 1)) == [3]
+    assert cache.stats()['items'] == 1
+
+
+def test_lru_disabled():
+    cache = LRUCache(0)
+    cache.put(('a', 1), [1])
+    assert cache.get(('a', 1), 'missing') == 'missing'
+    assert cache.size == 0
+
+
+def test_single_flight_coalesces():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = list()
+
+    def function():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    results = list()
+    leader = threading.Thread(target=lambda: results.append(flights.do('key', function)))
+    leader.start()
+    started.wait(5)
+
+    followers = [threading.Thread(target=lambda: results.append(flights.do('key', function))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flights.coalesced < 3:
+        threading.Event().wait(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert results == ['result'] * 4
+    assert len(calls) == 1
+
+    # results are not kept
+    assert flights.do('key', lambda: 'new') == 'new'
+
+
+def test_single_flight_error():
+    flights = SingleFlight()
+
+    def function():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        flights.do('key', function)
+    assert flights.do('key', lambda: 'ok') == 'ok'
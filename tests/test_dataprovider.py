@@ -0,0 +1,96 @@
+"""Tests for :mod:`dataprovider` which do not need a database."""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dataprovider import DataProvider  # noqa: E402
+from lapindex import LapIntervalIndex  # noqa: E402
+
+
+SESSION_START = datetime(2099, 3, 15, 14, 0)
+
+
+def make_laps():
+    """Three laps of 90 s each for HAM (44) and VER (33); session time 0 is SESSION_START"""
+    laps = list()
+    for driver_number in ('44', '33'):
+        for lap_number in (1, 2, 3):
+            start = (lap_number - 1) * 90.0
+            laps.append({'_id': len(laps), 'DriverNumber': driver_number, 'LapNumber': lap_number,
+                         'LapTime': 90.0, 'Time': start + 90.0,
+                         'LapStartDate': SESSION_START + timedelta(seconds=start),
+                         'LapEndDate': SESSION_START + timedelta(seconds=start + 90.0)})
+    return laps
+
+
+def make_telemetry(lap):
+    start = lap['Time'] - lap['LapTime']
+    times = [start + i for i in range(91)]
+    return {'SessionTime': times, 'Speed': [float(i) for i in range(91)]}
+
+
+@pytest.fixture
+def dp(monkeypatch):
+    data_provider = DataProvider('mongodb://localhost:27017', connect=False)
+    laps = make_laps()
+    index = LapIntervalIndex(laps)
+
+    monkeypatch.setattr(data_provider, 'check_revisions', lambda: None)
+    monkeypatch.setattr(data_provider, 'get_lap_index', lambda session_id: index)
+    monkeypatch.setattr(data_provider, 'get_lap_summary', lambda session_id: pytest.fail("summary is not used"))
+    monkeypatch.setattr(data_provider, '_fetch_telemetry_concurrently',
+                        lambda session_id, chunk, channels, columnar, arrays=False: {lap['_id']: make_telemetry(lap)
+                                                                                     for _, lap in chunk})
+    return data_provider
+
+
+def timestamp(seconds):
+    """Milliseconds since the epoch of SESSION_START + `seconds`"""
+    return ((SESSION_START + timedelta(seconds=seconds)) - datetime(1970, 1, 1)).total_seconds() * 1000
+
+
+def test_window_without_select_by(dp):
+    payload = {'session': '2099-1-1', 'drivers': ['HAM', 'VER'], 'channel': 'Speed',
+               'timeStartValue': timestamp(80), 'timeEndValue': timestamp(100)}
+
+    data = dp.get_telemetry_data(payload, columnar=True, clip=True)
+
+    assert [(lap['driver'], lap['lapnumber']) for lap in data] == [('HAM', 1), ('HAM', 2), ('VER', 1), ('VER', 2)]
+    for lap in data:
+        times = lap['telemetry']['SessionTime']
+        assert times and all(80 <= time <= 100 for time in times)
+
+
+def test_window_ignores_select_by(dp):
+    payload = {'session': '2099-1-1', 'drivers': ['HAM'], 'channel': 'Speed', 'selectBy': 'laps', 'laps': [3],
+               'timeStartValue': timestamp(10), 'timeEndValue': timestamp(20)}
+
+    data = dp.get_telemetry_data(payload, columnar=True, clip=True)
+    assert [lap['lapnumber'] for lap in data] == [1]
+
+
+def test_fastest_laps_are_cached_per_driver(monkeypatch):
+    data_provider = DataProvider('mongodb://localhost:27017', connect=False)
+    laps = make_laps()
+    laps[4]['LapTime'] = 89.0  # VER, lap 2
+    queried = list()
+
+    def query(session_id, drivernumbers, lap, timerange, starts_in, ends_in):
+        queried.append(list(drivernumbers))
+        return [min((itm for itm in laps if itm['DriverNumber'] == number), key=lambda itm: itm['LapTime'])
+                for number in sorted(drivernumbers)]
+
+    monkeypatch.setattr(data_provider, 'check_revisions', lambda: None)
+    monkeypatch.setattr(data_provider, '_query_timing_data', query)
+
+    # warm-up order
+    data_provider.get_timing_data_multi('2099-1-1', ['33', '44'], lap='fastest')
+    fastest = data_provider.get_timing_data_multi('2099-1-1', ['44', '33'], lap='fastest')
+    assert [(itm['DriverNumber'], itm['LapNumber']) for itm in fastest] == [('44', 1), ('33', 2)]
+    assert [itm['_id'] for itm in data_provider.get_timing_data_multi('2099-1-1', ['33'], lap='fastest')] == [4]
+    assert queried == [['33', '44']]
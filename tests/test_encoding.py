@@ -0,0 +1,78 @@
+"""Tests for :mod:`encoding`."""
+
+import json
+import os
+import struct
+import sys
+from array import array
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import encoding  # noqa: E402
+
+
+def decode(data):
+    """Decode a complete stream; return a list of (frame header, dict channel name -> list of values)"""
+    assert data[:8] == encoding.STREAM_HEADER
+    offset = 8
+    frames = list()
+    while offset < len(data):
+        header_length, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        header = json.loads(data[offset:offset + header_length].decode('utf-8'))
+        offset += header_length
+
+        channels = dict()
+        for name, dtype in header['channels']:
+            values = array('d' if dtype == 'f8' else 'f')
+            values.frombytes(data[offset:offset + header['length'] * values.itemsize])
+            if sys.byteorder == 'big':
+                values.byteswap()
+            offset += header['length'] * values.itemsize
+            channels[name] = [None if value != value else value for value in values]  # NaN -> None
+        frames.append((header, channels))
+    return frames
+
+
+def make_lap(telemetry):
+    return {'driver': 'HAM', 'laptime': 85.645, 'lapnumber': 15, 'telemetry': telemetry}
+
+
+def test_round_trip():
+    telemetry = {'SessionTime': [1354.446, 1354.658, 1354.871], 'Speed': [356, None, 357.5],
+                 'Brake': [True, False, True], 'RPM': []}
+
+    (header, channels), = decode(encoding.encode_telemetry([make_lap(telemetry)]))
+
+    assert header == {'driver': 'HAM', 'laptime': 85.645, 'lapnumber': 15, 'length': 3,
+                      'channels': [['SessionTime', 'f8'], ['Speed', 'f4'], ['Brake', 'f4'], ['RPM', 'f4']]}
+    assert channels == {'SessionTime': [1354.446, 1354.658, 1354.871], 'Speed': [356.0, None, 357.5],
+                        'Brake': [1.0, 0.0, 1.0], 'RPM': [None, None, None]}
+
+
+def test_arrays_match_lists():
+    telemetry = {'SessionTime': [1354.446, 1354.658, 1354.871], 'Speed': [356.0, float('nan'), 357.5],
+                 'Brake': [True, False, True], 'nGear': [7, 7, 8]}
+    as_arrays = {name: np.array(values) for name, values in telemetry.items()}
+
+    assert encoding.encode_lap(make_lap(as_arrays)) == encoding.encode_lap(make_lap(telemetry))
+
+
+@pytest.mark.parametrize('values', [['a', 'b'], np.array(['a', 'b'])])
+def test_non_numeric(values):
+    with pytest.raises(ValueError):
+        encoding.encode_lap(make_lap({'SessionTime': [1.0, 2.0], 'Status': values}))
+
+
+def test_length_mismatch():
+    with pytest.raises(ValueError):
+        encoding.encode_lap(make_lap({'SessionTime': [1.0, 2.0], 'Speed': [1.0]}))
+
+
+def test_check_channels():
+    encoding.check_channels(('SessionTime', 'Speed', 'Brake'))
+    with pytest.raises(ValueError):
+        encoding.check_channels(('Speed', 'Date'))
@@ -0,0 +1,116 @@
+"""Tests for :mod:`lapindex`; results are compared with a brute-force filter over all laps."""
+
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from lapindex import LapIntervalIndex  # noqa: E402
+
+
+SESSION_START = datetime(2099, 3, 15, 14, 0)
+
+
+def make_laps(seed):
+    """Laps of three drivers with random lap times; some laps have no end date or no dates at all ('inf')"""
+    rng = random.Random(seed)
+    laps = list()
+    for driver_number in ('44', '33', '16'):
+        start = SESSION_START + timedelta(seconds=rng.uniform(0, 30))
+        for lap_number in range(1, 31):
+            duration = timedelta(seconds=rng.uniform(80, 140))
+            lap = {'_id': len(laps), 'DriverNumber': driver_number, 'LapNumber': lap_number,
+                   'LapStartDate': start, 'LapEndDate': start + duration}
+            kind = rng.random()
+            if kind < 0.1:
+                lap['LapEndDate'] = 'inf'  # no lap time (e.g. in/out lap)
+            elif kind < 0.13:
+                lap['LapStartDate'] = lap['LapEndDate'] = 'inf'
+            laps.append(lap)
+            start += duration
+    laps[-1]['LapEndDate'] = 'inf'  # still running
+    return laps
+
+
+def brute_force(laps, start, end, starts_in, ends_in):
+    ret = list()
+    for lap in laps:
+        lap_start, lap_end = lap['LapStartDate'], lap['LapEndDate']
+        if not isinstance(lap_start, datetime):
+            continue
+        if starts_in or ends_in:
+            if starts_in and not start <= lap_start <= end:
+                continue
+            if ends_in and not (isinstance(lap_end, datetime) and start <= lap_end <= end):
+                continue
+        else:
+            if not isinstance(lap_end, datetime):
+                # lasts until the driver's next lap starts; open-ended if there is none
+                later = [itm['LapStartDate'] for itm in laps if itm['DriverNumber'] == lap['DriverNumber']
+                         and isinstance(itm['LapStartDate'], datetime) and itm['LapStartDate'] > lap_start]
+                lap_end = min(later) if later else datetime.max
+            if not (lap_start <= end and lap_end >= start):
+                continue
+        ret.append(lap['_id'])
+    return sorted(ret)
+
+
+def ranges(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        start = SESSION_START + timedelta(seconds=rng.uniform(-300, 4500))
+        yield start, start + timedelta(seconds=rng.choice((0, 1, 30, 200, 1000)) * rng.random())
+    yield datetime.min, datetime.max
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('starts_in, ends_in', [(True, True), (True, False), (False, True), (False, False)])
+def test_find_matches_brute_force(seed, starts_in, ends_in):
+    laps = make_laps(seed)
+    index = LapIntervalIndex(laps)
+
+    for start, end in ranges(seed):
+        found = index.find(start, end, starts_in, ends_in)
+        assert sorted(lap['_id'] for lap in found) == brute_force(laps, start, end, starts_in, ends_in)
+
+        key = 'LapEndDate' if ends_in and not starts_in else 'LapStartDate'
+        assert [lap[key] for lap in found] == sorted(lap[key] for lap in found)
+
+
+def test_find_drivers():
+    laps = make_laps(0)
+    index = LapIntervalIndex(laps)
+
+    found = index.find(datetime.min, datetime.max, True, False, drivernumbers=('44', '16'))
+    expected = [lap['_id'] for lap in laps
+                if lap['DriverNumber'] in ('44', '16') and isinstance(lap['LapStartDate'], datetime)]
+    assert sorted(lap['_id'] for lap in found) == expected
+
+
+def test_lap_without_end_date():
+    start = SESSION_START
+    laps = [{'_id': 0, 'DriverNumber': '44', 'LapStartDate': start, 'LapEndDate': 'inf'},
+            {'_id': 1, 'DriverNumber': '44', 'LapStartDate': start + timedelta(seconds=100),
+             'LapEndDate': start + timedelta(seconds=190)},
+            {'_id': 2, 'DriverNumber': '44', 'LapStartDate': start + timedelta(seconds=190), 'LapEndDate': 'inf'}]
+    index = LapIntervalIndex(laps)
+
+    def ids(*args):
+        return [lap['_id'] for lap in index.find(start + timedelta(seconds=args[0]), start + timedelta(seconds=args[1]),
+                                                 *args[2:])]
+
+    assert ids(0, 200, True, False) == [0, 1, 2]
+    assert ids(0, 200, True, True) == [1]
+    assert ids(50, 60, False, False) == [0]  # lasts until the next lap starts
+    assert ids(5000, 6000, False, False) == [2]  # open-ended
+    assert ids(150, 150, False, False) == [1]
+
+
+def test_empty():
+    index = LapIntervalIndex([])
+    assert len(index) == 0
+    assert index.find(datetime.min, datetime.max, False, False) == []
@@ -0,0 +1,54 @@
+"""Tests for :mod:`processing`."""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import processing  # noqa: E402
+
+
+def make_lap(n_samples, n_channels, seed=0):
+    rng = np.random.default_rng(seed)
+    lap = {'SessionTime': np.arange(n_samples, dtype=float).tolist()}
+    for channel in range(n_channels):
+        lap['Channel{}'.format(channel)] = rng.random(n_samples).tolist()
+    return lap
+
+
+@pytest.mark.parametrize('n_channels', [0, 1, 2, 4])
+@pytest.mark.parametrize('max_points', [2, 3, 5, 9, 10, 11, 50])
+def test_downsample_max_points(n_channels, max_points):
+    lap = make_lap(500, n_channels)
+
+    result = processing.downsample(lap, max_points)
+    times = result['SessionTime']
+    assert 2 <= len(times) <= max_points
+    assert times[0] == 0 and times[-1] == 499
+    assert all(len(values) == len(times) for values in result.values())
+
+    rows = [dict(zip(lap.keys(), values)) for values in zip(*lap.values())]
+    assert processing.downsample(rows, max_points) == [dict(zip(result.keys(), values))
+                                                       for values in zip(*result.values())]
+
+
+def test_downsample_keeps_peaks():
+    lap = make_lap(1000, 1)
+    lap['Channel0'][400] = 10.0
+    lap['Channel0'][600] = -10.0
+
+    result = processing.downsample(lap, 20)
+    assert 10.0 in result['Channel0'] and -10.0 in result['Channel0']
+
+
+def test_downsample_short_lap():
+    lap = make_lap(5, 2)
+    assert processing.downsample(lap, 5) is lap
+
+
+def test_downsample_invalid():
+    with pytest.raises(ValueError):
+        processing.downsample(make_lap(10, 1), 1)